@@ -2,3 +2,4 @@ from DAS.simulator import *
 from DAS.shape import *
 from DAS.visualizer import *
 from DAS.visualizor import *
+from DAS.vectorized import *
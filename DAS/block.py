@@ -1,8 +1,10 @@
 #!/bin/python3
 
 import random
+import numpy as np
 from bitarray import bitarray
 from bitarray.util import zeros
+from itertools import chain
 
 class Block:
     """This class represents a block in the Ethereum blockchain."""
@@ -79,6 +81,45 @@ class Block:
             ret = zeros(self.blockSizeR)
         return ret
 
+    def getRecoverable(self):
+        """It returns the block with all the segments that repairs could ever restore.
+
+        Rows with at least blockSizeRK segments and columns with at least
+        blockSizeCK segments are repaired in bulk, on a boolean matrix,
+        until no more line can be. This is the largest set of segments the
+        network can ever hold, and the block is recoverable iff it comes
+        out full.
+        """
+        matrix = self.getMatrix()
+        while True:
+            rows = matrix.sum(axis=1)
+            repairRows = (rows >= self.blockSizeRK) & (rows < self.blockSizeR)
+            matrix[repairRows] = True
+            columns = matrix.sum(axis=0)
+            repairColumns = (columns >= self.blockSizeCK) & (columns < self.blockSizeC)
+            matrix[:, repairColumns] = True
+            if not repairRows.any() and not repairColumns.any():
+                break
+        block = Block(self.blockSizeR, self.blockSizeRK, self.blockSizeC, self.blockSizeCK)
+        block.setMatrix(matrix)
+        return block
+
+    def getMatrix(self):
+        """It returns the segments as a boolean matrix, with one row per block row."""
+        segments = np.unpackbits(np.frombuffer(self.data.tobytes(), dtype=np.uint8), count=len(self.data))
+        return segments.astype(bool).reshape(self.blockSizeC, self.blockSizeR)
+
+    def setMatrix(self, matrix):
+        """It sets the segments from a boolean matrix, with one row per block row."""
+        data = bitarray(endian=self.data.endian())
+        data.frombytes(np.packbits(matrix).tobytes())
+        del data[len(self.data):]
+        self.setData(data)
+
+    def setData(self, data):
+        """It sets the segments from a bitarray, in the layout of data."""
+        self.data = data
+
     def print(self):
         """It prints the block in the terminal (outside of the logger rules))."""
         dash = "-" * (self.blockSizeR+2)
@@ -90,3 +131,200 @@ class Block:
             print(line+"|")
         print(dash)
 
+
+class DualBlock(Block):
+    """This class represents a block stored both by rows and by columns.
+
+    On top of the row-major data of Block, columns holds the same segments
+    column by column, so that columns are read and repaired with contiguous
+    slices, as rows are. Every write updates both layouts.
+    """
+
+    def __init__(self, blockSizeR, blockSizeRK=0, blockSizeC=0, blockSizeCK=0):
+        """Initialize both layouts with zeros."""
+        super().__init__(blockSizeR, blockSizeRK, blockSizeC, blockSizeCK)
+        self.columns = zeros(self.blockSizeR*self.blockSizeC)
+
+    def fill(self):
+        """It fills the block data with ones."""
+        self.data.setall(1)
+        self.columns.setall(1)
+
+    def merge(self, merged):
+        """It merges (OR) the existing block with the received one."""
+        self.data |= merged.data
+        if isinstance(merged, DualBlock):
+            self.columns |= merged.columns
+        else:
+            self.setData(self.data)
+
+    def setData(self, data):
+        """It sets the segments from a bitarray, in the layout of data, and transposes them to columns."""
+        self.data = data
+        self.columns = bitarray(endian=data.endian())
+        self.columns.frombytes(np.packbits(self.getMatrix().T).tobytes())
+        del self.columns[len(data):]
+
+    def setSegment(self, rowID, columnID, value = 1):
+        """Set value for a segment (default 1)"""
+        self.data[rowID*self.blockSizeR + columnID] = value
+        self.columns[columnID*self.blockSizeC + rowID] = value
+
+    def getColumn(self, columnID):
+        """It returns the block column corresponding to columnID."""
+        return self.columns[columnID*self.blockSizeC:(columnID+1)*self.blockSizeC]
+
+    def mergeColumn(self, columnID, column):
+        """It merges (OR) the existing column with the received one."""
+        self.columns[columnID*self.blockSizeC:(columnID+1)*self.blockSizeC] |= column
+        self.data[columnID::self.blockSizeR] = self.getColumn(columnID)
+
+    def repairColumn(self, id):
+        """It repairs the entire column if it has at least blockSizeCK ones.
+            Returns: list of repaired segments
+        """
+        line = self.getColumn(id)
+        success = line.count(1)
+        if success >= self.blockSizeCK:
+            ret = ~line
+            self.columns[id*self.blockSizeC:(id+1)*self.blockSizeC] = 1
+            self.data[id::self.blockSizeR] = 1
+        else:
+            ret = zeros(self.blockSizeC)
+        return ret
+
+    def mergeRow(self, rowID, row):
+        """It merges (OR) the existing row with the received one."""
+        self.data[rowID*self.blockSizeR:(rowID+1)*self.blockSizeR] |= row
+        self.columns[rowID::self.blockSizeC] = self.getRow(rowID)
+
+    def repairRow(self, id):
+        """It repairs the entire row if it has at least blockSizeRK ones.
+            Returns: list of repaired segments.
+        """
+        line = self.getRow(id)
+        success = line.count(1)
+        if success >= self.blockSizeRK:
+            ret = ~line
+            self.data[id*self.blockSizeR:(id+1)*self.blockSizeR] = 1
+            self.columns[id::self.blockSizeC] = 1
+        else:
+            ret = zeros(self.blockSizeR)
+        return ret
+
+
+class LineBlock:
+    """This class represents the part of a block a node is subscribed to.
+
+    Only the given rows and columns are stored, with their intersections kept
+    in both. It offers the same interface as Block for the subscribed lines;
+    segments outside of them read as zeros and cannot be set.
+    """
+
+    def __init__(self, blockSizeR, blockSizeRK=0, blockSizeC=0, blockSizeCK=0, rowIDs=(), columnIDs=()):
+        """Initialize the subscribed rows and columns with zeros."""
+        self.blockSizeR = blockSizeR
+        self.blockSizeRK = blockSizeRK if blockSizeRK else blockSizeR/2
+        self.blockSizeC = blockSizeC if blockSizeC else blockSizeR
+        self.blockSizeCK = blockSizeCK if blockSizeCK else blockSizeRK
+        self.rows = {id: zeros(self.blockSizeR) for id in rowIDs}
+        self.columns = {id: zeros(self.blockSizeC) for id in columnIDs}
+
+    def fill(self):
+        """It fills the subscribed lines with ones."""
+        for line in chain(self.rows.values(), self.columns.values()):
+            line.setall(1)
+
+    def merge(self, merged):
+        """It merges (OR) the subscribed lines with the ones of the received block."""
+        for id, line in self.rows.items():
+            line |= merged.getRow(id)
+        for id, line in self.columns.items():
+            line |= merged.getColumn(id)
+
+    def getSegment(self, rowID, columnID):
+        """Check whether a segment is included"""
+        if rowID in self.rows:
+            return self.rows[rowID][columnID]
+        elif columnID in self.columns:
+            return self.columns[columnID][rowID]
+        else:
+            return 0
+
+    def setSegment(self, rowID, columnID, value = 1):
+        """Set value for a segment (default 1) in the subscribed lines containing it"""
+        if rowID in self.rows:
+            self.rows[rowID][columnID] = value
+        if columnID in self.columns:
+            self.columns[columnID][rowID] = value
+
+    def getColumn(self, columnID):
+        """It returns the block column corresponding to columnID."""
+        if columnID in self.columns:
+            return self.columns[columnID].copy()
+        column = zeros(self.blockSizeC)
+        for id, row in self.rows.items():
+            column[id] = row[columnID]
+        return column
+
+    def mergeColumn(self, columnID, column):
+        """It merges (OR) the existing column with the received one."""
+        if columnID in self.columns:
+            self.columns[columnID] |= column
+        for id, row in self.rows.items():
+            if column[id]:
+                row[columnID] = 1
+
+    def repairColumn(self, id):
+        """It repairs the entire column if it has at least blockSizeCK ones.
+            Returns: list of repaired segments
+        """
+        line = self.getColumn(id)
+        success = line.count(1)
+        if success >= self.blockSizeCK:
+            ret = ~line
+            self.mergeColumn(id, ret)
+        else:
+            ret = zeros(self.blockSizeC)
+        return ret
+
+    def getRow(self, rowID):
+        """It returns the block row corresponding to rowID."""
+        if rowID in self.rows:
+            return self.rows[rowID].copy()
+        row = zeros(self.blockSizeR)
+        for id, column in self.columns.items():
+            row[id] = column[rowID]
+        return row
+
+    def mergeRow(self, rowID, row):
+        """It merges (OR) the existing row with the received one."""
+        if rowID in self.rows:
+            self.rows[rowID] |= row
+        for id, column in self.columns.items():
+            if row[id]:
+                column[rowID] = 1
+
+    def repairRow(self, id):
+        """It repairs the entire row if it has at least blockSizeRK ones.
+            Returns: list of repaired segments.
+        """
+        line = self.getRow(id)
+        success = line.count(1)
+        if success >= self.blockSizeRK:
+            ret = ~line
+            self.mergeRow(id, ret)
+        else:
+            ret = zeros(self.blockSizeR)
+        return ret
+
+    def print(self):
+        """It prints the block in the terminal (outside of the logger rules))."""
+        dash = "-" * (self.blockSizeR+2)
+        print(dash)
+        for i in range(self.blockSizeC):
+            line = "|"
+            for j in range(self.blockSizeR):
+                line += "%i" % self.getSegment(i, j)
+            print(line+"|")
+        print(dash)
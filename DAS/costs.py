@@ -0,0 +1,92 @@
+#!/bin/python3
+
+import sqlite3
+import numpy as np
+
+class CostModel:
+    """This class estimates the runtime of shapes, so that studies run the most expensive ones first.
+
+    The estimate starts as a static cost computed from the shape parameters
+    (see getStaticCost). The runtimes of the runs are recorded in an SQLite
+    database, per engine, and refine it: shapes that already ran (in any
+    run) are estimated by their mean runtime, and the others by a power law
+    of their static cost fitted on the recorded runtimes.
+    """
+
+    def __init__(self, path, engine):
+        """It opens the runtimes recorded in path (None to only use static costs), for runs with engine."""
+        self.engine = engine
+        self.connection = sqlite3.connect(path, timeout=60) if path else None
+        if self.connection:
+            with self.connection:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS runtimes (shape TEXT, engine TEXT, runs TEXT,"
+                                        " cost REAL, runtime REAL, PRIMARY KEY (shape, engine))")
+        self.runtimes = {}
+        self.fit = None
+
+    @staticmethod
+    def getStaticCost(shape):
+        """It returns the static cost of shape: the segments held by all nodes, times the degree of their meshes.
+
+        Each node exchanges the segments of its lines with its neighbors at
+        every step, so this is proportional to the work of a step.
+        """
+        held = 0
+        for ratio, vpn in ((shape.class1ratio, shape.vpn1), (1 - shape.class1ratio, shape.vpn2)):
+            rows = min(vpn * shape.chiR, shape.blockSizeC)
+            columns = min(vpn * shape.chiC, shape.blockSizeR)
+            held += ratio * (rows * shape.blockSizeR + columns * shape.blockSizeC)
+        return shape.numberNodes * shape.netDegree * held
+
+    @staticmethod
+    def getRunsKey(shape):
+        """It returns what a shape has in common with its other runs."""
+        return repr(sorted((k, v) for k, v in shape.__dict__.items()
+                           if k not in ("run", "randomSeed", "topologySeed")))
+
+    def record(self, result):
+        """It records the runtime of a result."""
+        if self.connection:
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO runtimes VALUES (?, ?, ?, ?, ?)",
+                                        (str(result.shape), self.engine, self.getRunsKey(result.shape),
+                                         self.getStaticCost(result.shape), result.runtime))
+
+    def load(self):
+        """It loads the recorded runtimes, and fits static costs on them.
+
+        The fit is a line in log-log scale, with a slope of 1 (runtime
+        proportional to cost) if costs are too few to fit it.
+        """
+        self.runtimes = {}
+        self.fit = None
+        if not self.connection:
+            return
+        rows = self.connection.execute("SELECT runs, AVG(cost), AVG(runtime) FROM runtimes"
+                                       " WHERE engine = ? AND runtime > 0 GROUP BY runs", (self.engine,)).fetchall()
+        if not rows:
+            return
+        self.runtimes = {runs: runtime for runs, cost, runtime in rows}
+        costs, runtimes = np.log([[cost, runtime] for runs, cost, runtime in rows]).T
+        if len(np.unique(costs)) >= 3:
+            slope, intercept = np.polyfit(costs, runtimes, 1)
+            if slope > 0:
+                self.fit = (slope, intercept)
+                return
+        self.fit = (1, np.mean(runtimes - costs))
+
+    def estimate(self, shape):
+        """It returns the estimated runtime of shape (in seconds if runtimes were recorded, in cost units otherwise)."""
+        runs = self.getRunsKey(shape)
+        if runs in self.runtimes:
+            return self.runtimes[runs]
+        cost = self.getStaticCost(shape)
+        if self.fit:
+            slope, intercept = self.fit
+            return float(np.exp(intercept + slope * np.log(cost)))
+        return cost
+
+    def schedule(self, shapes):
+        """It returns shapes sorted by decreasing estimated runtime, keeping the order of equal ones."""
+        self.load()
+        return sorted(shapes, key=self.estimate, reverse=True)
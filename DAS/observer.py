@@ -51,7 +51,7 @@ class Observer:
         validated = 0
         for val in validators:
             if val.amIproposer == 0:
-                (a, e, v) = val.checkStatus()
+                (a, e, v) = val.getStatus()
                 arrived += a
                 expected += e
                 if a == e:
@@ -68,9 +68,11 @@ class Observer:
             Sample are counted on both rows and columns, so intersections of interest are counted twice.
             - sampleProgress: previous expressed as progress ratio
             - nodeProgress: ratio of nodes having all segments interested in
-            - validatorProgress: same as above, but vpn weighted average. I.e. it counts per validator,
+            - validatorAllProgress: same as above, but vpn weighted average. I.e. it counts per validator,
             but counts a validator only if its support node's all validators see all interesting segments
-            TODO: add real per validator progress counter
+            - validatorProgress: ratio of validators having all segments interested in
+
+            Values are read from the progress counters of the validators, so this costs O(1) per node.
             """
             arrived, expected, ready, validatedall, validated = self.checkStatus(validators)
             missingSamples = expected - arrived
@@ -0,0 +1,137 @@
+#!/bin/python3
+
+import random
+import hashlib
+import numpy as np
+from bitarray import bitarray, frozenbitarray
+from DAS.block import Block
+
+# failure model name -> generator of the segments released by the proposer
+failureModels = {}
+# failure models whose pattern is drawn at random
+seededModels = set()
+# generated patterns, by failure model, block size and seed
+patternCache = {}
+patternCacheSize = 16
+
+def failureModel(name, seeded=False):
+    """It registers the decorated function as the pattern generator of a failure model.
+
+    A generator is called with the shape and a NumPy random generator, used
+    only if seeded, and returns a boolean matrix with one row per block row,
+    True for the segments the proposer releases.
+    """
+    def register(generator):
+        failureModels[name] = generator
+        if seeded:
+            seededModels.add(name)
+        return generator
+    return register
+
+def releasedCount(shape):
+    """It returns the number of segments released at the failure rate of shape."""
+    return int((1 - shape.failureRate/100) * shape.blockSizeR * shape.blockSizeC)
+
+def blockIndices(shape):
+    """It returns the row and column index of each segment, as broadcastable arrays."""
+    return np.ogrid[:shape.blockSizeC, :shape.blockSizeR]
+
+@failureModel("random", seeded=True)
+def randomPattern(shape, rng):
+    """Segments released at random, up to the failure rate."""
+    released = np.zeros(shape.blockSizeR * shape.blockSizeC, dtype=bool)
+    released[rng.choice(len(released), releasedCount(shape), replace=False)] = True
+    return released.reshape(shape.blockSizeC, shape.blockSizeR)
+
+@failureModel("sequential")
+def sequentialPattern(shape, rng):
+    """The first segments released, in row order, up to the failure rate."""
+    released = np.zeros(shape.blockSizeR * shape.blockSizeC, dtype=bool)
+    released[:releasedCount(shape)] = True
+    return released.reshape(shape.blockSizeC, shape.blockSizeR)
+
+@failureModel("MEP")
+def minimalErasurePattern(shape, rng):
+    """Minimal size non-recoverable Erasure Pattern."""
+    r, c = blockIndices(shape)
+    return (r > shape.blockSizeCK) | (c > shape.blockSizeRK)
+
+@failureModel("MEP+1")
+def minimalErasurePatternPlusOne(shape, rng):
+    """MEP +1 segment to make it recoverable."""
+    released = minimalErasurePattern(shape, rng)
+    released[0, 0] = True
+    return released
+
+@failureModel("DEP")
+def diagonalErasurePattern(shape, rng):
+    """Diagonal Erasure Pattern, non-recoverable."""
+    assert(shape.blockSizeR == shape.blockSizeC and shape.blockSizeRK == shape.blockSizeCK)
+    r, c = blockIndices(shape)
+    return (r + c) % shape.blockSizeR > shape.blockSizeRK
+
+@failureModel("DEP+1")
+def diagonalErasurePatternPlusOne(shape, rng):
+    """DEP +1 segment to make it recoverable."""
+    released = diagonalErasurePattern(shape, rng)
+    released[0, 0] = True
+    return released
+
+@failureModel("MREP")
+def minimalRecoverableErasurePattern(shape, rng):
+    """Minimum size Recoverable Erasure Pattern."""
+    r, c = blockIndices(shape)
+    return (r < shape.blockSizeCK) | (c < shape.blockSizeRK)
+
+@failureModel("MREP-1")
+def minimalRecoverableErasurePatternMinusOne(shape, rng):
+    """MREP -1 segment to make it non-recoverable."""
+    released = minimalRecoverableErasurePattern(shape, rng)
+    released[0, 0] = False
+    return released
+
+@failureModel("columnBurst", seeded=True)
+def columnBurstPattern(shape, rng):
+    """Whole adjacent columns withheld, from a random one on (wrapping), up to the failure rate."""
+    count = int(shape.failureRate/100 * shape.blockSizeR)
+    r, c = blockIndices(shape)
+    burst = (c - rng.integers(shape.blockSizeR)) % shape.blockSizeR < count
+    return np.broadcast_to(~burst, (shape.blockSizeC, shape.blockSizeR)).copy()
+
+@failureModel("diagonal")
+def diagonalStripesPattern(shape, rng):
+    """Diagonal stripes withheld, the failure rate of each row starting on the diagonal."""
+    count = int(shape.failureRate/100 * shape.blockSizeR)
+    r, c = blockIndices(shape)
+    return (c - r) % shape.blockSizeR >= count
+
+def getPattern(shape):
+    """It returns the segments released by the proposer of shape, as block data.
+
+    Patterns drawing randomness are drawn from the seed of the shape if it
+    has one (deterministic studies), and from the random module otherwise.
+    Patterns are cached per failure model, block size and seed, as all the
+    runs of a study with the same block and failures release the same one.
+    """
+    if shape.failureModel not in failureModels:
+        raise ValueError("Unknown failure model %s" % shape.failureModel)
+    seeded = shape.failureModel in seededModels
+    if seeded and not shape.randomSeed:
+        rng = np.random.default_rng(random.getrandbits(64))
+        return toBlockData(shape, failureModels[shape.failureModel](shape, rng))
+
+    key = (shape.failureModel, shape.failureRate, shape.blockSizeR, shape.blockSizeRK,
+           shape.blockSizeC, shape.blockSizeCK, shape.randomSeed if seeded else "")
+    if key not in patternCache:
+        seed = int.from_bytes(hashlib.sha256(key[-1].encode()).digest()[:8], "little")
+        pattern = failureModels[shape.failureModel](shape, np.random.default_rng(seed))
+        if len(patternCache) >= patternCacheSize:
+            del patternCache[next(iter(patternCache))]
+        patternCache[key] = frozenbitarray(toBlockData(shape, pattern))
+    return bitarray(patternCache[key])
+
+def toBlockData(shape, pattern):
+    """It returns the bitarray of block data holding the segments of a boolean matrix."""
+    block = Block(shape.blockSizeR, shape.blockSizeRK, shape.blockSizeC, shape.blockSizeCK)
+    block.setMatrix(pattern)
+    return block.data
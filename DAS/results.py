@@ -2,8 +2,18 @@
 
 import os
 import bisect
+import pickle
+import shutil
+import hashlib
+import tempfile
+import sqlite3
+import zipfile
+from functools import lru_cache
 from xml.dom import minidom
+import numpy as np
+import pandas as pd
 from dicttoxml import dicttoxml
+from DAS.shape import Shape
 
 class Result:
     """This class stores and process/store the results of a simulation."""
@@ -14,6 +24,7 @@ class Result:
         self.execID = execID
         self.blockAvailable = -1
         self.tta = -1
+        self.runtime = 0 # seconds spent running the simulation, after its initialization
         self.missingVector = []
         self.metrics = {}
 
@@ -34,19 +45,302 @@ class Result:
         """Generic function to add a metric to the results."""
         self.metrics[name] = metric
 
-    def dump(self):
-        """It dumps the results of the simulation in an XML file."""
-        if not os.path.exists("results"):
-            os.makedirs("results")
-        if not os.path.exists("results/"+self.execID):
-            os.makedirs("results/"+self.execID)
-        resd1 = self.shape.__dict__
+    def dump(self, format="xml"):
+        """It dumps the results of the simulation in the folder of the study.
+
+        With the "npz" format, they are appended to the results.npz archive
+        of the study (see ResultArchive), consolidated at its end. Otherwise,
+        they are written to their own XML file.
+        """
+        folderPath = "results/"+self.execID
+        os.makedirs(folderPath, exist_ok=True)
+        if format == "npz":
+            ResultArchive(folderPath+"/results.npz").append(self)
+        else:
+            with open(folderPath+"/"+str(self.shape)+".xml", "w") as f:
+                f.write(self.toXML())
+        ResultIndex(folderPath+"/results.sqlite").add(self)
+
+    def toXML(self):
+        """It returns the results of the simulation as a pretty printed XML document."""
+        resd1 = self.shape.__dict__.copy()
         resd2 = self.__dict__.copy()
         resd2.pop("shape")
         resd1.update(resd2)
         resXml = dicttoxml(resd1)
         xmlstr = minidom.parseString(resXml)
-        xmlPretty = xmlstr.toprettyxml()
-        filePath = "results/"+self.execID+"/"+str(self.shape)+".xml"
-        with open(filePath, "w") as f:
-            f.write(xmlPretty)
+        return xmlstr.toprettyxml()
+
+
+class ResultArchive:
+    """This class stores the results of a study in one compressed NPZ file.
+
+    The results of a run are a group of arrays named after its shape:
+    "<shape>/scalars", a record holding the shape parameters (as
+    "shape.<parameter>") and the scalar outcomes, and one array per step
+    vector: "missingVector", "metrics.progress" (a record array with one
+    field per column) and the row/column distributions. Each result is
+    first written to its own NPZ file in the parts folder, atomically, so
+    that parallel runs can append results and a crash loses none. The parts
+    are then merged into the archive by consolidate, at the end of the
+    study. The archive can also be read with numpy.load.
+    """
+
+    def __init__(self, path):
+        """It initializes the archive stored in path."""
+        self.path = path
+        self.partsPath = path + ".parts"
+
+    def getArrays(self, result):
+        """It returns the arrays of a result, by name."""
+        scalars = {"shape."+name: value for name, value in result.shape.__dict__.items()}
+        arrays = {}
+        for name, value in result.__dict__.items():
+            if name == "metrics":
+                for metric, values in value.items():
+                    if isinstance(values, dict):
+                        columns = [np.asarray(column) for column in values.values()]
+                        arrays["metrics."+metric] = np.rec.fromarrays(columns, names=list(values)) if columns else np.array([])
+                    else:
+                        arrays["metrics."+metric] = np.asarray(values)
+            elif name == "missingVector":
+                arrays[name] = np.asarray(value)
+            elif name != "shape":
+                scalars[name] = value
+        values = [np.asarray(value) for value in scalars.values()]
+        arrays["scalars"] = np.array(tuple(values), dtype=[(name, value.dtype) for name, value in zip(scalars, values)])
+        return arrays
+
+    def append(self, result):
+        """It writes the arrays of a result to its part, replacing the previous result of its shape."""
+        os.makedirs(self.partsPath, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=self.partsPath)
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, **self.getArrays(result))
+        os.replace(tmp, os.path.join(self.partsPath, str(result.shape) + ".npz"))
+
+    def consolidate(self):
+        """It merges the parts into the archive, and removes them.
+
+        A part replaces the result of its shape already in the archive. The
+        archive is rewritten to a temporary file and then renamed, so that
+        it is never left incomplete.
+        """
+        if not os.path.isdir(self.partsPath):
+            return
+        parts = sorted((name for name in os.listdir(self.partsPath) if name.endswith(".npz") and not name.startswith(".tmp-")),
+                       key=lambda name: os.path.getmtime(os.path.join(self.partsPath, name)))
+        keys = {name[:-len(".npz")] for name in parts}
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(self.path) or ".")
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            if os.path.exists(self.path):
+                with zipfile.ZipFile(self.path) as previous:
+                    for info in previous.infolist():
+                        if info.filename.split("/", 1)[0] not in keys:
+                            self.copyMember(previous, info.filename, archive, info.filename)
+            for name in parts:
+                with zipfile.ZipFile(os.path.join(self.partsPath, name)) as part:
+                    for member in part.namelist():
+                        self.copyMember(part, member, archive, name[:-len(".npz")] + "/" + member)
+        os.replace(tmp, self.path)
+        shutil.rmtree(self.partsPath)
+
+    def copyMember(self, source, name, archive, target):
+        """It copies the member name of the zip file source to the member target of archive."""
+        with source.open(name) as src, archive.open(target, "w", force_zip64=True) as dst:
+            shutil.copyfileobj(src, dst)
+
+    def getGroups(self, archive):
+        """It returns the array names of the archive, grouped by result, in the order they were written."""
+        groups = {}
+        for name in archive.files:
+            key, field = name.split("/", 1)
+            groups.setdefault(key, []).append(field)
+        return groups
+
+    def load(self):
+        """It returns the results stored in the archive."""
+        results = []
+        with np.load(self.path) as archive:
+            for key, fields in self.getGroups(archive).items():
+                shape = Shape.__new__(Shape)
+                result = Result(shape, None)
+                for field in fields:
+                    array = archive[key+"/"+field]
+                    if field == "scalars":
+                        for name in array.dtype.names:
+                            if name.startswith("shape."):
+                                setattr(shape, name[len("shape."):], array[name].item())
+                            else:
+                                setattr(result, name, array[name].item())
+                    elif field.startswith("metrics."):
+                        if array.dtype.names:
+                            value = {name: array[name].tolist() for name in array.dtype.names}
+                        else:
+                            value = array.tolist()
+                        result.metrics[field[len("metrics."):]] = value
+                    else:
+                        setattr(result, field, array.tolist())
+                results.append(result)
+        return results
+
+    def getColumns(self):
+        """It returns the shape (representation), shape parameters and scalar outcomes of the results, as a DataFrame with one row per result.
+
+        Step vectors are not read.
+        """
+        rows = []
+        with np.load(self.path) as archive:
+            for key in self.getGroups(archive):
+                scalars = archive[key+"/scalars"]
+                rows.append(dict({name.split(".")[-1]: scalars[name].item() for name in scalars.dtype.names}, shape=key))
+        return pd.DataFrame(rows)
+
+    def exportXML(self, folderPath):
+        """It writes each result of the archive to an XML file in folderPath, as Result.dump does."""
+        os.makedirs(folderPath, exist_ok=True)
+        for result in self.load():
+            with open(folderPath+"/"+str(result.shape)+".xml", "w") as f:
+                f.write(result.toXML())
+
+
+class ResultIndex:
+    """This class indexes the shape parameters and scalar outcomes of results in an SQLite database.
+
+    There is one row per run, so that plots can query and aggregate results
+    (see getTTAGrids) without reading them. Rows are added as results are
+    dumped, and SQLite locking lets parallel runs add them to the same
+    database.
+    """
+
+    # shape parameters and outcomes, with their SQL types
+    columns = {"run": "INTEGER", "numberNodes": "INTEGER", "blockSizeR": "INTEGER", "blockSizeRK": "INTEGER",
+               "blockSizeC": "INTEGER", "blockSizeCK": "INTEGER", "failureModel": "TEXT", "failureRate": "INTEGER",
+               "class1ratio": "REAL", "chiR": "INTEGER", "chiC": "INTEGER", "vpn1": "INTEGER", "vpn2": "INTEGER",
+               "netDegree": "INTEGER", "bwUplinkProd": "INTEGER", "bwUplink1": "INTEGER", "bwUplink2": "INTEGER",
+               "blockAvailable": "INTEGER", "tta": "REAL"}
+
+    def __init__(self, path):
+        """It opens the index stored in path (":memory:" for a temporary one), creating it if needed."""
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (shape TEXT PRIMARY KEY, %s)"
+                                    % ", ".join("%s %s" % column for column in self.columns.items()))
+
+    def __len__(self):
+        """It returns the number of results indexed."""
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def clear(self):
+        """It removes all results from the index."""
+        with self.connection:
+            self.connection.execute("DELETE FROM results")
+
+    def add(self, result):
+        """It adds a result to the index, replacing the previous one of its shape."""
+        self.addRows([dict(result.shape.__dict__, shape=str(result.shape), blockAvailable=result.blockAvailable, tta=result.tta)])
+
+    def addRows(self, rows):
+        """It adds results given as dicts of shape parameters and outcomes, plus their shape representation."""
+        names = ["shape"] + list(self.columns)
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO results (%s) VALUES (%s)" % (", ".join(names), ", ".join("?" * len(names))),
+                                        [[row.get(name) for name in names] for row in rows])
+
+    def query(self, sql, params=()):
+        """It returns the rows of an SQL query on the results table, as a DataFrame."""
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    def getTTAGrids(self, x, y, fixed, failedTTA=-1):
+        """It returns the average time to block availability for each (x, y) value pair, one grid per value of the fixed parameters.
+
+        Runs (and any parameter neither x, y nor fixed) are averaged,
+        counting only the runs that made the block available. Pairs without
+        any are set to failedTTA. Grids are DataFrames with y values as
+        index and x values as columns, keyed by the tuple of fixed values.
+        """
+        groups = [x, y] + list(fixed)
+        df = self.query("SELECT %s, AVG(CASE WHEN tta != -1 THEN tta END) AS tta FROM results GROUP BY %s"
+                        % (", ".join(groups), ", ".join(groups)))
+        df["tta"] = df["tta"].fillna(failedTTA)
+        if not fixed:
+            return {(): df.pivot(columns=x, index=y, values="tta")}
+        return {key if isinstance(key, tuple) else (key,): group.pivot(columns=x, index=y, values="tta")
+                for key, group in df.groupby(list(fixed))}
+
+
+# modules of the DAS package that the results of a simulation depend on
+simulationModules = ("block", "observer", "patterns", "shape", "simulator", "tools", "topology", "validator", "vectorized")
+
+@lru_cache(maxsize=None)
+def codeVersion():
+    """It returns a hash of the sources of the simulator (the simulationModules of the DAS package)."""
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in simulationModules:
+        digest.update(name.encode())
+        with open(os.path.join(directory, name+".py"), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    """This class stores the results of deterministic runs on disk, so that studies can skip the shapes already computed.
+
+    An entry is a pickled Result, named after a hash of the shape and the
+    config options results depend on. Entries are kept per version of the
+    simulator code, so that changing the code invalidates them, and only the
+    most recently used versions are kept (see prune). They are written to a
+    temporary file and then renamed, so parallel runs can share a cache.
+    """
+
+    version = 1 # to be increased when results change outside of the simulationModules
+    # config options that change results (besides the shape), the seeds
+    # of runs being derived from the shape and randomSeed
+    options = ("engine", "topologyBackend", "hopelessRuns", "evenLineDistribution", "stepDuration", "segmentSize",
+               "deterministic", "randomSeed", "steps4StopCondition", "successCondition", "saveProgress", "saveRCdist")
+    # number of versions of the simulator code whose entries are kept
+    keptVersions = 3
+
+    def __init__(self, directory, config):
+        """It initializes the cache of the results of runs with config."""
+        self.directory = directory
+        self.path = os.path.join(directory, codeVersion())
+        self.values = {name: getattr(config, name, None) for name in self.options}
+
+    def getPath(self, shape):
+        """It returns the path of the entry of a shape."""
+        params = dict(self.values, shape=repr(shape), version=self.version)
+        key = hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()
+        return os.path.join(self.path, key + ".pkl")
+
+    def load(self, shape):
+        """It returns the result of shape, or None if it was not saved."""
+        path = self.getPath(shape)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, result):
+        """It saves the result of a run."""
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=self.path)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(result, f)
+        os.replace(tmp, self.getPath(result.shape))
+
+    def prune(self):
+        """It removes the entries of the versions of the simulator code used the least recently, keeping keptVersions.
+
+        The current version counts as the most recently used one.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        os.utime(self.path)
+        versions = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                    if len(name) == len(codeVersion()) and os.path.isdir(os.path.join(self.directory, name))]
+        versions.sort(key=os.path.getmtime, reverse=True)
+        for path in versions[self.keptVersions:]:
+            if path != self.path:
+                shutil.rmtree(path, ignore_errors=True)
@@ -24,6 +24,7 @@ class Shape:
         self.bwUplink1 = bwUplink1
         self.bwUplink2 = bwUplink2
         self.randomSeed = ""
+        self.topologySeed = ""
 
     def __repr__(self):
         """Returns a printable representation of the shape"""
@@ -47,7 +48,26 @@ class Shape:
         shastr += "-r-"+str(self.run)
         return shastr
 
+    def topologyRepr(self):
+        """Returns a printable representation of the parameters the topology depends on"""
+        shastr = ""
+        shastr += "bsrn-"+str(self.blockSizeR)
+        shastr += "-bscn-"+str(self.blockSizeC)
+        shastr += "-nn-"+str(self.numberNodes)
+        shastr += "-c1r-"+str(self.class1ratio)
+        shastr += "-chir-"+str(self.chiR)
+        shastr += "-chic-"+str(self.chiC)
+        shastr += "-vpn1-"+str(self.vpn1)
+        shastr += "-vpn2-"+str(self.vpn2)
+        shastr += "-nd-"+str(self.netDegree)
+        shastr += "-r-"+str(self.run)
+        return shastr
+
     def setSeed(self, seed):
         """Adds the random seed to the shape"""
         self.randomSeed = seed
 
+    def setTopologySeed(self, seed):
+        """Adds the random seed of the topology (line assignments and meshes) to the shape"""
+        self.topologySeed = seed
+
@@ -1,7 +1,7 @@
 #!/bin/python
 
-import networkx as nx
 import logging, random
+import numpy as np
 import pandas as pd
 from functools import partial, partialmethod
 from datetime import datetime
@@ -9,6 +9,12 @@ from DAS.tools import *
 from DAS.results import *
 from DAS.observer import *
 from DAS.validator import *
+from DAS.topology import *
+
+try:
+    import networkx as nx
+except ImportError:
+    nx = None # only needed with topologyBackend = "networkx"
 
 class Simulator:
     """This class implements the main DAS simulator."""
@@ -43,84 +49,155 @@ class Simulator:
         # self.shape.netDegree: default behavior similar (but not same) to previous code
         self.proposerPublishTo = self.shape.netDegree   # TODO: make this an external parameter
 
+        # Line assignments and meshes only depend on the topology seed and parameters,
+        # so they can be shared between runs, e.g. of a failureRates sweep.
+        self.topologyCache = None
+        self.topology = None # arrays loaded from the topology cache
+        if config.topologyCache and shape.topologySeed:
+            self.topologyCache = TopologyCache(config.topologyCache, {
+                "seed": shape.topologySeed,
+                "evenLineDistribution": config.evenLineDistribution,
+                "topologyBackend": config.topologyBackend,
+                "proposerPublishOnly": self.proposerPublishOnly,
+                "proposerPublishTo": self.proposerPublishTo})
+
+    def initEvenLineDistribution(self, rng):
+        """It shuffles the rows and columns to be distributed evenly between validators."""
+        lightNodes = int(self.shape.numberNodes * self.shape.class1ratio)
+        heavyNodes = self.shape.numberNodes - lightNodes
+        lightVal = lightNodes * self.shape.vpn1
+        heavyVal = heavyNodes * self.shape.vpn2
+        totalValidators = lightVal + heavyVal
+        totalRows = totalValidators * self.shape.chiR
+        totalColumns = totalValidators * self.shape.chiC
+        rows =    rng.permutation(np.resize(np.arange(self.shape.blockSizeC), totalRows))
+        columns = rng.permutation(np.resize(np.arange(self.shape.blockSizeR), totalColumns))
+        self.evenRows = rows
+        self.evenColumns = columns
+        self.lightVal = lightVal
+        self.logger.debug("There is a total of %d nodes, %d light and %d heavy." % (self.shape.numberNodes, lightNodes, heavyNodes), extra=self.format)
+        self.logger.debug("There is a total of %d validators, %d in light nodes and %d in heavy nodes" % (totalValidators, lightVal, heavyVal), extra=self.format)
+        self.logger.debug("Shuffling a total of %d rows to be assigned (X=%d)" % (len(rows), self.shape.chiR), extra=self.format)
+        self.logger.debug("Shuffling a total of %d columns to be assigned (X=%d)" % (len(columns), self.shape.chiC), extra=self.format)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Shuffled rows: %s" % str(rows), extra=self.format)
+            self.logger.debug("Shuffled columns: %s" % str(columns), extra=self.format)
+
+    def sampleLines(self, rng, count, size, k):
+        """It draws count sets of k distinct lines out of size, as the rows of a (count, k) array."""
+        if 2 * k > size:
+            return np.argsort(rng.random((count, size)), axis=1)[:, :k]
+        lines = rng.integers(0, size, (count, k))
+        while True:
+            sortedLines = np.sort(lines, axis=1)
+            redraw = np.flatnonzero((sortedLines[:, 1:] == sortedLines[:, :-1]).any(axis=1))
+            if len(redraw) == 0:
+                return lines
+            lines[redraw] = rng.integers(0, size, (len(redraw), k))
+
+    def assignLines(self):
+        """It assigns rows and columns to the validators of all nodes at once.
+
+        It returns the node of each validator (the proposer has none), and
+        the chiR rows and chiC columns of each validator as the rows of two
+        arrays. Nodes get vpn1 or vpn2 validators as in Validator. With
+        evenLineDistribution, validators take consecutive chunks of a
+        shuffled list of lines, where all lines appear (about) the same
+        number of times (light nodes first, see initEvenLineDistribution).
+        Otherwise each validator draws its lines at random.
+        Assignments are loaded from the topology cache if it has them.
+        """
+        if self.topologyCache and self.topologyCache.exists():
+            self.logger.debug("Loading topology from %s" % self.topologyCache.path, extra=self.format)
+            self.topology = self.topologyCache.load()
+            self.lines = tuple(np.asarray(self.topology[name]) for name in ("valNode", "rows", "columns"))
+            return self.lines
+
+        shape = self.shape
+        rng = np.random.default_rng(random.getrandbits(64))
+        nodes = np.arange(shape.numberNodes)
+        vpn = np.where(nodes <= shape.numberNodes * shape.class1ratio, shape.vpn1, shape.vpn2)
+        vpn[self.proposerID] = 0
+        valNode = np.repeat(nodes, vpn)
+        firstVal = np.cumsum(vpn) - vpn
+        if self.config.evenLineDistribution:
+            self.initEvenLineDistribution(rng)
+            lightNodes = int(shape.numberNodes * shape.class1ratio)
+            slot = np.where(nodes < lightNodes, nodes * shape.vpn1, self.lightVal + (nodes - lightNodes) * shape.vpn2)
+            slot = slot[valNode] + np.arange(len(valNode)) - firstVal[valNode]
+            rows = self.evenRows.reshape(-1, shape.chiR)[slot]
+            columns = self.evenColumns.reshape(-1, shape.chiC)[slot]
+        else:
+            rows = self.sampleLines(rng, len(valNode), shape.blockSizeC, shape.chiR)
+            columns = self.sampleLines(rng, len(valNode), shape.blockSizeR, shape.chiC)
+        self.lines = (valNode, rows, columns)
+        return self.lines
+
+    def saveTopology(self, meshes):
+        """It saves the line assignments and meshes in the topology cache."""
+        arrays = dict(zip(("valNode", "rows", "columns"), self.lines))
+        for mesh in meshes:
+            arrays.update(mesh.getArrays("mesh%d" % mesh.dim))
+        self.topologyCache.save(arrays)
+
     def initValidators(self):
         """It initializes all the validators in the network."""
         self.glob = Observer(self.logger, self.shape)
         self.validators = []
-        if self.config.evenLineDistribution:
-
-            lightNodes = int(self.shape.numberNodes * self.shape.class1ratio)
-            heavyNodes = self.shape.numberNodes - lightNodes
-            lightVal = lightNodes * self.shape.vpn1
-            heavyVal = heavyNodes * self.shape.vpn2
-            totalValidators = lightVal + heavyVal
-            totalRows = totalValidators * self.shape.chiR
-            totalColumns = totalValidators * self.shape.chiC
-            rows =    list(range(self.shape.blockSizeC)) * (int(totalRows/self.shape.blockSizeC)+1)
-            columns = list(range(self.shape.blockSizeR)) * (int(totalColumns/self.shape.blockSizeR)+1)
-            rows =    rows[0:totalRows]
-            columns = columns[0:totalRows]
-            random.shuffle(rows)
-            random.shuffle(columns)
-            offsetR = lightVal*self.shape.chiR
-            offsetC = lightVal*self.shape.chiC
-            self.logger.debug("There is a total of %d nodes, %d light and %d heavy." % (self.shape.numberNodes, lightNodes, heavyNodes), extra=self.format)
-            self.logger.debug("There is a total of %d validators, %d in light nodes and %d in heavy nodes" % (totalValidators, lightVal, heavyVal), extra=self.format)
-            self.logger.debug("Shuffling a total of %d rows to be assigned (X=%d)" % (len(rows), self.shape.chiR), extra=self.format)
-            self.logger.debug("Shuffling a total of %d columns to be assigned (X=%d)" % (len(columns), self.shape.chiC), extra=self.format)
-            self.logger.debug("Shuffled rows: %s" % str(rows), extra=self.format)
-            self.logger.debug("Shuffled columns: %s" % str(columns), extra=self.format)
+        valNode, rows, columns = self.assignLines()
+        bounds = np.searchsorted(valNode, np.arange(self.shape.numberNodes + 1)).tolist()
+        flatRows = rows.ravel().tolist()
+        flatColumns = columns.ravel().tolist()
+        debug = self.logger.isEnabledFor(logging.DEBUG)
 
-        assignedRows = []
-        assignedCols = []
         for i in range(self.shape.numberNodes):
-            if self.config.evenLineDistribution:
-                if i < int(lightVal/self.shape.vpn1):  # First start with the light nodes
-                    startR =   i  *self.shape.chiR*self.shape.vpn1
-                    endR   = (i+1)*self.shape.chiR*self.shape.vpn1
-                    startC =   i  *self.shape.chiC*self.shape.vpn1
-                    endC   = (i+1)*self.shape.chiC*self.shape.vpn1
-                else:
-                    j = i - int(lightVal/self.shape.vpn1)
-                    startR = offsetR+(  j  *self.shape.chiR*self.shape.vpn2)
-                    endR   = offsetR+((j+1)*self.shape.chiR*self.shape.vpn2)
-                    startC = offsetC+(  j  *self.shape.chiC*self.shape.vpn2)
-                    endC   = offsetC+((j+1)*self.shape.chiC*self.shape.vpn2)
-                r = rows[startR:endR]
-                c = columns[startC:endC]
-                val = Validator(i, int(not i!=0), self.logger, self.shape, self.config, r, c)
+            if i == self.proposerID:
+                r, c = None, None
+            else:
+                r = flatRows[bounds[i]*self.shape.chiR:bounds[i+1]*self.shape.chiR]
+                c = flatColumns[bounds[i]*self.shape.chiC:bounds[i+1]*self.shape.chiC]
+            val = Validator(i, int(not i!=0), self.logger, self.shape, self.config, r, c)
+            if debug:
                 self.logger.debug("Node %d has row IDs: %s" % (val.ID, val.rowIDs), extra=self.format)
                 self.logger.debug("Node %d has column IDs: %s" % (val.ID, val.columnIDs), extra=self.format)
-                assignedRows = assignedRows + list(r)
-                assignedCols = assignedCols + list(c)
+            if self.config.evenLineDistribution:
                 self.nodeRows.append(val.rowIDs)
                 self.nodeColumns.append(val.columnIDs)
-
-            else:
-                val = Validator(i, int(not i!=0), self.logger, self.shape, self.config)
-            if i == self.proposerID:
-                val.initBlock()
-            else:
+            if i != self.proposerID:
                 val.logIDs()
             self.validators.append(val)
 
-        assignedRows.sort()
-        assignedCols.sort()
-        self.logger.debug("Rows assigned: %s" % str(assignedRows), extra=self.format)
-        self.logger.debug("Columns assigned: %s" % str(assignedCols), extra=self.format)
+        if debug:
+            self.logger.debug("Rows assigned: %s" % str(sorted(rows.ravel().tolist())), extra=self.format)
+            self.logger.debug("Columns assigned: %s" % str(sorted(columns.ravel().tolist())), extra=self.format)
         self.logger.debug("Validators initialized.", extra=self.format)
 
-    def initNetwork(self):
-        """It initializes the simulated network."""
-        rowChannels = [[] for i in range(self.shape.blockSizeC)]
-        columnChannels = [[] for i in range(self.shape.blockSizeR)]
-        for v in self.validators:
-            if not (self.proposerPublishOnly and v.amIproposer):
-                for id in v.rowIDs:
-                    rowChannels[id].append(v)
-                for id in v.columnIDs:
-                    columnChannels[id].append(v)
+    def initGraph(self, size, lineName, id):
+        """It returns the mesh graph of a row or column topic with size members.
 
+        If the number of nodes in a channel is smaller or equal to the
+        requested degree, a fully connected graph is used. For n>d, a random
+        d-regular graph is set up. (For n=d+1, the two are the same.)
+        """
+        if (size <= self.shape.netDegree):
+            self.logger.debug("Graph fully connected with degree %d !" % (size - 1), extra=self.format)
+            G = nx.complete_graph(size)
+        else:
+            G = nx.random_regular_graph(self.shape.netDegree, size)
+        if not nx.is_connected(G):
+            self.logger.error("Graph not connected for %s %d !" % (lineName, id), extra=self.format)
+        return G
+
+    def initMeshes(self, rowChannels, columnChannels):
+        """It builds the row and column meshes between the nodes subscribed to each line.
+
+        Channels list the IDs of the nodes in each row/column topic. If
+        proposerPublishOnly, the proposer gets one-way links to
+        proposerPublishTo nodes of each line. Meshes are loaded from, or else
+        saved to, the topology cache if there is one. With the "numpy" topologyBackend,
+        the graphs of all the rows, then all the columns, are drawn in one
+        batch (see randomRegularGraphs), otherwise each one is drawn by networkx.
+        """
         # Check rows/columns distribution
         for r in rowChannels:
             self.distR.append(len(r))
@@ -129,57 +206,61 @@ class Simulator:
         self.logger.debug("Number of validators per row; Min: %d, Max: %d" % (min(self.distR), max(self.distR)), extra=self.format)
         self.logger.debug("Number of validators per column; Min: %d, Max: %d" % (min(self.distC), max(self.distC)), extra=self.format)
 
-        for id in range(self.shape.blockSizeC):
+        meshes = (Mesh(0, self.shape.blockSizeC), Mesh(1, self.shape.blockSizeR))
+        if self.topology is not None:
+            for mesh in meshes:
+                mesh.setArrays(self.topology, "mesh%d" % mesh.dim)
+            return meshes
 
-            # If the number of nodes in a channel is smaller or equal to the
-            # requested degree, a fully connected graph is used. For n>d, a random
-            # d-regular graph is set up. (For n=d+1, the two are the same.)
-            if not rowChannels[id]:
-                self.logger.error("No nodes for row %d !" % id, extra=self.format)
-                continue
-            elif (len(rowChannels[id]) <= self.shape.netDegree):
-                self.logger.debug("Graph fully connected with degree %d !" % (len(rowChannels[id]) - 1), extra=self.format)
-                G = nx.complete_graph(len(rowChannels[id]))
-            else:
-                G = nx.random_regular_graph(self.shape.netDegree, len(rowChannels[id]))
-            if not nx.is_connected(G):
-                self.logger.error("Graph not connected for row %d !" % id, extra=self.format)
-            for u, v in G.edges:
-                val1=rowChannels[id][u]
-                val2=rowChannels[id][v]
-                val1.rowNeighbors[id].update({val2.ID : Neighbor(val2, 0, self.shape.blockSizeR)})
-                val2.rowNeighbors[id].update({val1.ID : Neighbor(val1, 0, self.shape.blockSizeR)})
-
-        for id in range(self.shape.blockSizeR):
-
-            if not columnChannels[id]:
-                self.logger.error("No nodes for column %d !" % id, extra=self.format)
-                continue
-            elif (len(columnChannels[id]) <= self.shape.netDegree):
-                self.logger.debug("Graph fully connected with degree %d !" % (len(columnChannels[id]) - 1), extra=self.format)
-                G = nx.complete_graph(len(columnChannels[id]))
+        if self.config.topologyBackend == "numpy":
+            rng = np.random.default_rng(random.getrandbits(64))
+        for mesh, channels, lineName in zip(meshes, (rowChannels, columnChannels), ("row", "column")):
+            if self.config.topologyBackend == "numpy":
+                sizes = np.array([len(c) for c in channels], dtype=np.int64)
+                graph, u, v, connected = randomRegularGraphs(sizes, self.shape.netDegree, rng)
+                nodes = np.array([id for c in channels for id in c], dtype=np.int64)
+                nodeStart = np.cumsum(sizes) - sizes
+                mesh.addEdgeArrays(graph, nodes[nodeStart[graph] + u], nodes[nodeStart[graph] + v])
+                for id in range(mesh.lineCount):
+                    if not channels[id]:
+                        self.logger.error("No nodes for %s %d !" % (lineName, id), extra=self.format)
+                    elif not connected[id]:
+                        self.logger.error("Graph not connected for %s %d !" % (lineName, id), extra=self.format)
             else:
-                G = nx.random_regular_graph(self.shape.netDegree, len(columnChannels[id]))
-            if not nx.is_connected(G):
-                self.logger.error("Graph not connected for column %d !" % id, extra=self.format)
-            for u, v in G.edges:
-                val1=columnChannels[id][u]
-                val2=columnChannels[id][v]
-                val1.columnNeighbors[id].update({val2.ID : Neighbor(val2, 1, self.shape.blockSizeC)})
-                val2.columnNeighbors[id].update({val1.ID : Neighbor(val1, 1, self.shape.blockSizeC)})
+                for id in range(mesh.lineCount):
+                    if not channels[id]:
+                        self.logger.error("No nodes for %s %d !" % (lineName, id), extra=self.format)
+                        continue
+                    G = self.initGraph(len(channels[id]), lineName, id)
+                    mesh.addEdges(id, channels[id], G.edges)
 
+        if self.proposerPublishOnly:
+            for mesh, channels in zip(meshes, (rowChannels, columnChannels)):
+                for id in range(mesh.lineCount):
+                    count = min(self.proposerPublishTo, len(channels[id]))
+                    mesh.addLinks(id, self.proposerID, random.sample(channels[id], count))
+
+        for mesh in meshes:
+            mesh.finalize()
+        if self.topologyCache:
+            self.saveTopology(meshes)
+        return meshes
+
+    def initNetwork(self):
+        """It initializes the simulated network."""
+        rowChannels = [[] for i in range(self.shape.blockSizeC)]
+        columnChannels = [[] for i in range(self.shape.blockSizeR)]
         for v in self.validators:
-            if (self.proposerPublishOnly and v.amIproposer):
+            if not (self.proposerPublishOnly and v.amIproposer):
                 for id in v.rowIDs:
-                    count = min(self.proposerPublishTo, len(rowChannels[id]))
-                    publishTo = random.sample(rowChannels[id], count)
-                    for vi in publishTo:
-                        v.rowNeighbors[id].update({vi.ID : Neighbor(vi, 0, self.shape.blockSizeR)})
+                    rowChannels[id].append(v.ID)
                 for id in v.columnIDs:
-                    count = min(self.proposerPublishTo, len(columnChannels[id]))
-                    publishTo = random.sample(columnChannels[id], count)
-                    for vi in publishTo:
-                        v.columnNeighbors[id].update({vi.ID : Neighbor(vi, 1, self.shape.blockSizeC)})
+                    columnChannels[id].append(v.ID)
+        self.meshes = self.initMeshes(rowChannels, columnChannels)
+
+        for mesh, blockSize in zip(self.meshes, (self.shape.blockSizeR, self.shape.blockSizeC)):
+            for src, dst, id in zip(mesh.src.tolist(), mesh.dst.tolist(), mesh.line.tolist()):
+                self.validators[src].addNeighbor(mesh.dim, id, self.validators[dst], blockSize)
 
         if self.logger.isEnabledFor(logging.DEBUG):
             for i in range(0, self.shape.numberNodes):
@@ -225,8 +306,8 @@ class Simulator:
                             self.logger.debug("Column %d, Neighbor %d sent: %s" % (c, val.columnNeighbors[c][nc].node.ID, val.columnNeighbors[c][nc].received), extra=self.format)
                             self.logger.debug("Column %d, Neighbor %d has: %s" % (c, val.columnNeighbors[c][nc].node.ID, self.validators[val.columnNeighbors[c][nc].node.ID].getColumn(c)), extra=self.format)
 
-    def run(self):
-        """It runs the main simulation until the block is available or it gets stucked."""
+    def prepareRun(self):
+        """It prepares the block and the nodes for the first step, returning the number of missing samples."""
         self.glob.checkRowsColumns(self.validators)
         for i in range(0,self.shape.numberNodes):
             if i == self.proposerID:
@@ -234,66 +315,159 @@ class Simulator:
             else:
                 self.validators[i].logIDs()
         arrived, expected, ready, validatedall, validated = self.glob.checkStatus(self.validators)
-        missingSamples = expected - arrived
+        return expected - arrived
+
+    def step(self, steps):
+        """It runs the send, receive, restore and log phases of a time step."""
+        self.logger.debug("PHASE SEND %d" % steps, extra=self.format)
+        for i in range(0,self.shape.numberNodes):
+            self.validators[i].send()
+        self.logger.debug("PHASE RECEIVE %d" % steps, extra=self.format)
+        for i in range(1,self.shape.numberNodes):
+            self.validators[i].receiveRowsColumns()
+        self.logger.debug("PHASE RESTORE %d" % steps, extra=self.format)
+        for i in range(1,self.shape.numberNodes):
+            self.validators[i].restoreRows()
+            self.validators[i].restoreColumns()
+        self.logger.debug("PHASE LOG %d" % steps, extra=self.format)
+        for i in range(0,self.shape.numberNodes):
+            self.validators[i].logRows()
+            self.validators[i].logColumns()
+
+    def getTrafficStats(self):
+        """It returns the TX and RX statistics of the current time step."""
+        return self.glob.getTrafficStats(self.validators)
+
+    def updateStats(self):
+        """It closes the TX and RX statistics of the current time step."""
+        for i in range(0,self.shape.numberNodes):
+            self.validators[i].updateStats()
+
+    def getProgress(self):
+        """It returns the progress metrics of the simulation (see Observer.getProgress)."""
+        return self.glob.getProgress(self.validators)
+
+    def getReachable(self):
+        """It returns the best outcome possible with the block released by the proposer.
+
+        From the segments that repairs could ever restore (see
+        Block.getRecoverable), it returns the number of samples that will
+        always be missing in nodes, counted as in getProgress, and the
+        highest ratio of validators that can have all their segments.
+        """
+        recoverable = self.validators[self.proposerID].block.getRecoverable()
+        rowMissing = [recoverable.getRow(id).count(0) for id in range(self.shape.blockSizeC)]
+        columnMissing = [recoverable.getColumn(id).count(0) for id in range(self.shape.blockSizeR)]
+        missingSamples = 0
+        validated = 0
+        validatorCnt = 0
+        for val in self.validators:
+            if val.amIproposer:
+                continue
+            missingSamples += sum(rowMissing[id] for id in val.rowIDs) + sum(columnMissing[id] for id in val.columnIDs)
+            for i in range(val.vpn):
+                if not any(rowMissing[id] for id in val.vRowIDs[i]) and not any(columnMissing[id] for id in val.vColumnIDs[i]):
+                    validated += 1
+            validatorCnt += val.vpn
+        return missingSamples, validated / validatorCnt
+
+    def getProgressEntry(self, sampleProgress, nodeProgress, validatorProgress, trafficStats):
+        """It returns the progress metrics of a time step, as saved in the results."""
+        cnS = "samples received"
+        cnN = "nodes ready"
+        cnV = "validators ready"
+        cnT0 = "TX builder mean"
+        cnT1 = "TX class1 mean"
+        cnT2 = "TX class2 mean"
+        cnR1 = "RX class1 mean"
+        cnR2 = "RX class2 mean"
+        cnD1 = "Dup class1 mean"
+        cnD2 = "Dup class2 mean"
+
+        return {
+            cnS:sampleProgress,
+            cnN:nodeProgress,
+            cnV:validatorProgress,
+            cnT0: trafficStats[0]["Tx"]["mean"],
+            cnT1: trafficStats[1]["Tx"]["mean"],
+            cnT2: trafficStats[2]["Tx"]["mean"],
+            cnR1: trafficStats[1]["Rx"]["mean"],
+            cnR2: trafficStats[2]["Rx"]["mean"],
+            cnD1: trafficStats[1]["RxDup"]["mean"],
+            cnD2: trafficStats[2]["RxDup"]["mean"],
+            }
+
+    def saveResult(self, missingVector, progressVector):
+        """It fills the result with the missing samples and progress of each time step."""
+        progress = pd.DataFrame(progressVector)
+        if self.config.saveRCdist:
+            self.result.addMetric("rowDist", self.distR)
+            self.result.addMetric("columnDist", self.distC)
+        if self.config.saveProgress:
+            self.result.addMetric("progress", progress.to_dict(orient='list'))
+        self.result.populate(self.shape, self.config, missingVector)
+        return self.result
+
+    def run(self):
+        """It runs the main simulation until the block is available or it gets stucked (see runSteps)."""
+        steps = self.runSteps(self.prepareRun())
+        try:
+            while True:
+                self.step(next(steps))
+        except StopIteration as stop:
+            return stop.value
+
+    def runSteps(self, missingSamples):
+        """It runs the main loop of the simulation, from the state left by prepareRun.
+
+        This generator yields the number of each time step to run, and leaves
+        running it to the caller, so that several simulations can advance
+        together (see ReplicaBatch). It returns the result.
+
+        With hopelessRuns set to "skip" or "shorten", the block released by
+        the proposer is checked first (see getReachable). If it can not
+        make enough validators ready, "skip" returns a result holding only
+        the initial state. Otherwise, the run stops as soon as every
+        segment that can still arrive did, instead of waiting for
+        steps4StopCondition steps without progress.
+        """
         missingVector = []
         progressVector = []
         trafficStatsVector = []
         steps = 0
+        reachableMissing = 0
+        if self.config.hopelessRuns in ("skip", "shorten"):
+            reachableMissing, reachableProgress = self.getReachable()
+            self.logger.debug("At best %d samples missing and %0.02f %% validators ready" % (reachableMissing, reachableProgress*100), extra=self.format)
+            if self.config.hopelessRuns == "skip" and reachableProgress < self.config.successCondition:
+                self.logger.debug("The block cannot be made available, failure rate %d, skipping!" % self.shape.failureRate, extra=self.format)
+                missingSamples, sampleProgress, nodeProgress, validatorAllProgress, validatorProgress = self.getProgress()
+                idle = {"Tx": {"mean": 0}, "Rx": {"mean": 0}, "RxDup": {"mean": 0}}
+                progressVector.append(self.getProgressEntry(sampleProgress, nodeProgress, validatorProgress, [idle] * 3))
+                return self.saveResult([missingSamples], progressVector)
         while(True):
             missingVector.append(missingSamples)
             oldMissingSamples = missingSamples
-            self.logger.debug("PHASE SEND %d" % steps, extra=self.format)
-            for i in range(0,self.shape.numberNodes):
-                self.validators[i].send()
-            self.logger.debug("PHASE RECEIVE %d" % steps, extra=self.format)
-            for i in range(1,self.shape.numberNodes):
-                self.validators[i].receiveRowsColumns()
-            self.logger.debug("PHASE RESTORE %d" % steps, extra=self.format)
-            for i in range(1,self.shape.numberNodes):
-                self.validators[i].restoreRows()
-                self.validators[i].restoreColumns()
-            self.logger.debug("PHASE LOG %d" % steps, extra=self.format)
-            for i in range(0,self.shape.numberNodes):
-                self.validators[i].logRows()
-                self.validators[i].logColumns()
+            yield steps
 
             # log TX and RX statistics
-            trafficStats = self.glob.getTrafficStats(self.validators)
+            trafficStats = self.getTrafficStats()
             self.logger.debug("step %d: %s" %
                 (steps, trafficStats), extra=self.format)
-            for i in range(0,self.shape.numberNodes):
-                self.validators[i].updateStats()
+            self.updateStats()
             trafficStatsVector.append(trafficStats)
 
-            missingSamples, sampleProgress, nodeProgress, validatorAllProgress, validatorProgress = self.glob.getProgress(self.validators)
+            missingSamples, sampleProgress, nodeProgress, validatorAllProgress, validatorProgress = self.getProgress()
             self.logger.info("step %d, arrived %0.02f %%, ready %0.02f %%, validatedall %0.02f %%, , validated %0.02f %%"
                               % (steps, sampleProgress*100, nodeProgress*100, validatorAllProgress*100, validatorProgress*100), extra=self.format)
 
-            cnS = "samples received"
-            cnN = "nodes ready"
-            cnV = "validators ready"
-            cnT0 = "TX builder mean"
-            cnT1 = "TX class1 mean"
-            cnT2 = "TX class2 mean"
-            cnR1 = "RX class1 mean"
-            cnR2 = "RX class2 mean"
-            cnD1 = "Dup class1 mean"
-            cnD2 = "Dup class2 mean"
-
-            progressVector.append({
-                cnS:sampleProgress,
-                cnN:nodeProgress,
-                cnV:validatorProgress,
-                cnT0: trafficStats[0]["Tx"]["mean"],
-                cnT1: trafficStats[1]["Tx"]["mean"],
-                cnT2: trafficStats[2]["Tx"]["mean"],
-                cnR1: trafficStats[1]["Rx"]["mean"],
-                cnR2: trafficStats[2]["Rx"]["mean"],
-                cnD1: trafficStats[1]["RxDup"]["mean"],
-                cnD2: trafficStats[2]["RxDup"]["mean"],
-                })
-
-            if missingSamples == oldMissingSamples:
+            progressVector.append(self.getProgressEntry(sampleProgress, nodeProgress, validatorProgress, trafficStats))
+
+            if reachableMissing and missingSamples <= reachableMissing:
+                self.logger.debug("No more segments can arrive, failure rate %d!" % self.shape.failureRate, extra=self.format)
+                missingVector.append(missingSamples)
+                break
+            elif missingSamples == oldMissingSamples:
                 if len(missingVector) > self.config.steps4StopCondition:
                     if missingSamples == missingVector[-self.config.steps4StopCondition]:
                         self.logger.debug("The block cannot be recovered, failure rate %d!" % self.shape.failureRate, extra=self.format)
@@ -307,12 +481,5 @@ class Simulator:
                 break
             steps += 1
 
-        progress = pd.DataFrame(progressVector)
-        if self.config.saveRCdist:
-            self.result.addMetric("rowDist", self.distR)
-            self.result.addMetric("columnDist", self.distC)
-        if self.config.saveProgress:
-            self.result.addMetric("progress", progress.to_dict(orient='list'))
-        self.result.populate(self.shape, self.config, missingVector)
-        return self.result
+        return self.saveResult(missingVector, progressVector)
 
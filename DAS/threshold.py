@@ -0,0 +1,144 @@
+#!/bin/python3
+
+import copy
+import math
+from statistics import NormalDist
+
+class ThresholdSearch:
+    """This class searches the failure rate at which the block stops being available, for given other shape parameters.
+
+    The threshold is where half of the runs make the block available. It
+    is bracketed by the lowest and highest failure rates searched, probed
+    together, then bisected down to a given precision. Each failure rate
+    probed runs minRuns times, and more (doubling, up to maxRuns) while the
+    confidence interval of its availability ratio (Wilson score interval)
+    includes 1/2, so runs concentrate near the transition. Runs of a failure rate are
+    numbered from 0, each with its own seeds.
+    """
+
+    def __init__(self, shape, low, high, minRuns=4, maxRuns=16, precision=1, confidence=0.95):
+        """It initializes the search between failure rates low and high, for the other parameters of shape."""
+        if low >= high:
+            raise ValueError("The search range of the threshold of %s is empty" % shape)
+        if precision < 1:
+            raise ValueError("The precision of the threshold of %s must be at least 1" % shape)
+        self.shape = shape
+        self.low = low
+        self.high = high
+        self.minRuns = minRuns
+        self.maxRuns = maxRuns
+        self.precision = precision
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        # failure rate -> availability of its runs, by run
+        self.runs = {}
+        # failure rate -> whether most of its runs make the block available
+        self.decided = {}
+        self.status = None
+
+    def getShape(self, failureRate, run):
+        """It returns the shape of a run at a failure rate."""
+        shape = copy.copy(self.shape)
+        shape.failureRate = failureRate
+        shape.run = run
+        shape.setSeed("")
+        shape.setTopologySeed("")
+        return shape
+
+    def getInterval(self, failureRate):
+        """It returns the confidence interval of the availability ratio at a failure rate."""
+        runs = list(self.runs[failureRate].values())
+        n, p = len(runs), sum(runs) / len(runs)
+        center = (p + self.z**2 / (2*n)) / (1 + self.z**2 / n)
+        spread = self.z / (1 + self.z**2 / n) * math.sqrt(p * (1 - p) / n + self.z**2 / (4 * n**2))
+        return center - spread, center + spread
+
+    def getRatio(self, failureRate):
+        """It returns the ratio of the runs at a failure rate that make the block available."""
+        runs = self.runs[failureRate]
+        return sum(runs.values()) / len(runs)
+
+    def getFailureRates(self):
+        """It returns the failure rates to probe next, none if the search is over.
+
+        The low and high failure rates are probed together, until both are
+        decided, then the middle of the bracket, rounded down, until it is
+        no longer strictly inside it.
+        """
+        if self.status is not None:
+            return []
+        failureRates = [failureRate for failureRate in (self.low, self.high) if failureRate not in self.decided]
+        if failureRates:
+            return failureRates
+        middle = (self.low + self.high) // 2
+        if self.high - self.low <= self.precision or not self.low < middle < self.high:
+            return []
+        return [middle]
+
+    def decide(self, failureRate):
+        """It narrows the bracket of the threshold with the availability at a failure rate, unless the search is over."""
+        if self.status is not None:
+            return
+        available = self.getRatio(failureRate) >= 0.5
+        self.decided[failureRate] = available
+        if failureRate == self.low and not available:
+            self.status = "below"
+        elif failureRate == self.high and available:
+            self.status = "above"
+        elif available:
+            self.low = failureRate
+        else:
+            self.high = failureRate
+
+    def getRunCount(self, failureRate):
+        """It returns the number of runs to add at a failure rate, 0 if its availability is known well enough."""
+        runs = self.runs.setdefault(failureRate, {})
+        if len(runs) < self.minRuns:
+            return self.minRuns - len(runs)
+        low, high = self.getInterval(failureRate)
+        if len(runs) < self.maxRuns and low <= 0.5 <= high:
+            return min(len(runs), self.maxRuns - len(runs))
+        return 0
+
+    def nextShapes(self):
+        """It returns the shapes of the runs to do next, none when the search is over."""
+        while True:
+            failureRates = self.getFailureRates()
+            if not failureRates:
+                if self.status is None:
+                    self.status = "found"
+                return []
+            shapes = []
+            for failureRate in failureRates:
+                count = self.getRunCount(failureRate)
+                if count == 0:
+                    self.decide(failureRate)
+                    if self.status is not None:
+                        return []
+                start = len(self.runs[failureRate])
+                shapes += [self.getShape(failureRate, run) for run in range(start, start + count)]
+            if shapes:
+                return shapes
+
+    def addResult(self, result):
+        """It adds the result of a run returned by nextShapes."""
+        self.runs[result.shape.failureRate][result.shape.run] = result.blockAvailable == 1
+
+    def getReport(self):
+        """It returns the outcome of the search.
+
+        Its status is "found" if the threshold is between the low and high
+        failure rates, "below" or "above" if it is outside of the search
+        range. The threshold is interpolated between the availability ratios
+        of low and high. The ratio of the runs making the block available at
+        each is given with the bounds of its confidence interval.
+        """
+        report = {"status": self.status, "failureRateLow": self.low, "failureRateHigh": self.high,
+                  "threshold": None, "runs": sum(len(runs) for runs in self.runs.values())}
+        for name, failureRate in (("Low", self.low), ("High", self.high)):
+            if self.runs.get(failureRate):
+                report["ratio"+name] = self.getRatio(failureRate)
+                report["ratio"+name+"Min"], report["ratio"+name+"Max"] = self.getInterval(failureRate)
+        if self.status == "found":
+            ratioLow, ratioHigh = report["ratioLow"], report["ratioHigh"]
+            report["threshold"] = self.low + (self.high - self.low) * (ratioLow - 0.5) / (ratioLow - ratioHigh)
+        return report
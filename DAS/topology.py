@@ -0,0 +1,290 @@
+#!/bin/python3
+
+import os
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+
+class Mesh:
+    """This class represents the mesh links of all row or column topics.
+
+    Links are directed and stored in CSR form, as arrays indexed by link: the
+    links of topic id are ptr[id]:ptr[id+1], going from node src to node dst.
+    The two links of an edge point to each other in rev, while one-way links,
+    like the ones of a publish only proposer, have rev -1. Per-link state can
+    then be kept in matrices with one row per link, the rows of a topic
+    forming one contiguous block.
+    """
+
+    def __init__(self, dim, lineCount):
+        """It initializes an empty mesh for lineCount topics of dimension dim (0:row 1:col)."""
+        self.dim = dim
+        self.lineCount = lineCount
+        self.chunks = [] # (line, src, dst, rev) arrays, rev indexing the chunk
+
+    def addEdges(self, id, nodes, edges):
+        """It adds both links of each (u, v) edge between nodes[u] and nodes[v] to topic id."""
+        edges = np.array(list(edges), dtype=np.int64).reshape(-1, 2)
+        nodes = np.asarray(nodes, dtype=np.int64)
+        self.addEdgeArrays(np.full(len(edges), id), nodes[edges[:, 0]], nodes[edges[:, 1]])
+
+    def addEdgeArrays(self, line, u, v):
+        """It adds both links of each edge between nodes u[i] and v[i] to topic line[i]."""
+        src = np.empty(2 * len(line), dtype=np.int64)
+        dst = np.empty(2 * len(line), dtype=np.int64)
+        src[0::2] = dst[1::2] = u
+        src[1::2] = dst[0::2] = v
+        rev = np.arange(2 * len(line)) ^ 1
+        self.chunks.append((np.repeat(line, 2), src, dst, rev))
+
+    def addLinks(self, id, src, dsts):
+        """It adds one-way links from node src to each node of dsts in topic id."""
+        dst = np.array(dsts, dtype=np.int64)
+        self.chunks.append((np.full(len(dst), id), np.full(len(dst), src), dst, np.full(len(dst), -1)))
+
+    def finalize(self):
+        """It converts the links added so far into the CSR arrays.
+
+        Links of a topic keep the order in which they were added.
+        """
+        offset = 0
+        lines, srcs, dsts, revs = [], [], [], []
+        for line, src, dst, rev in self.chunks:
+            lines.append(line)
+            srcs.append(src)
+            dsts.append(dst)
+            revs.append(np.where(rev >= 0, rev + offset, -1))
+            offset += len(line)
+        line = np.concatenate(lines).astype(np.int64) if lines else np.zeros(0, dtype=np.int64)
+        order = np.argsort(line, kind="stable")
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+        self.line = line[order]
+        self.src = np.concatenate(srcs)[order] if srcs else self.line.copy()
+        self.dst = np.concatenate(dsts)[order] if dsts else self.line.copy()
+        rev = np.concatenate(revs)[order] if revs else self.line.copy()
+        self.rev = np.where(rev >= 0, position[rev], -1)
+        self.ptr = np.zeros(self.lineCount + 1, dtype=np.int64)
+        self.ptr[1:] = np.cumsum(np.bincount(self.line, minlength=self.lineCount))
+        self.chunks = None
+
+    def getArrays(self, prefix):
+        """It returns the CSR arrays by name, each name starting with prefix."""
+        return {prefix + name: getattr(self, name) for name in ("ptr", "src", "dst", "line", "rev")}
+
+    def setArrays(self, arrays, prefix):
+        """It sets the CSR arrays from the ones returned by getArrays, instead of finalize."""
+        for name in ("ptr", "src", "dst", "line", "rev"):
+            setattr(self, name, arrays[prefix + name])
+        self.chunks = None
+
+    def __len__(self):
+        """It returns the number of links."""
+        return len(self.src)
+
+    def getLinks(self, id):
+        """It returns the range of links of topic id."""
+        return range(self.ptr[id], self.ptr[id+1])
+
+
+def configurationModel(sizes, degrees, rng):
+    """It pairs node stubs at random, giving degrees[g]-regular multigraphs on sizes[g] nodes.
+
+    Edges are returned as arrays (graph, u, v) of local node indices, sorted
+    by graph. Self-loops and multi-edges are possible.
+    """
+    stubs = sizes * degrees
+    stubGraph = np.repeat(np.arange(len(sizes)), stubs)
+    stubStart = np.repeat(np.cumsum(stubs) - stubs, stubs)
+    stubNode = (np.arange(len(stubGraph)) - stubStart) // np.repeat(degrees, stubs)
+    # shuffle stubs within each graph by sorting on (graph, random) keys
+    stubNode = stubNode[np.argsort(stubGraph << 40 | rng.integers(0, 1 << 40, len(stubGraph)))]
+    return stubGraph[0::2], stubNode[0::2], stubNode[1::2]
+
+def removeMultiEdges(graph, u, v, sizes, rng, maxRounds=1000):
+    """It replaces self-loops and multi-edges with double edge swaps, in place.
+
+    A bad edge (a, b) and a random edge (c, d) of the same graph become
+    (a, d) and (c, b), keeping all degrees. Each round swaps all bad edges at
+    once, skipping swaps that share an edge or would create a bad edge. After
+    the first round, only the graphs that still had bad edges are checked.
+    """
+    keyBase = int(sizes.max(initial=0)) + 1
+    edgeCount = np.bincount(graph, minlength=len(sizes))
+    edgeStart = np.cumsum(edgeCount) - edgeCount
+    edges = np.arange(len(graph))
+    for i in range(maxRounds):
+        key = (graph[edges] * keyBase + np.minimum(u[edges], v[edges])) * keyBase + np.maximum(u[edges], v[edges])
+        order = np.argsort(key)
+        sortedKey = key[order]
+        duplicate = np.zeros(len(key), dtype=bool)
+        duplicate[order[1:]] = sortedKey[1:] == sortedKey[:-1]
+        bad = edges[(u[edges] == v[edges]) | duplicate]
+        if len(bad) == 0:
+            return
+        badGraphs = np.zeros(len(sizes), dtype=bool)
+        badGraphs[graph[bad]] = True
+        edges = np.flatnonzero(badGraphs[graph])
+        partner = edgeStart[graph[bad]] + (rng.random(len(bad)) * edgeCount[graph[bad]]).astype(np.int64)
+        touched = np.bincount(np.concatenate((bad, partner)), minlength=len(graph))
+        keep = (bad != partner) & (touched[bad] == 1) & (touched[partner] == 1)
+        bad = bad[keep]
+        partner = partner[keep]
+        flip = rng.random(len(bad)) < 0.5
+        c = np.where(flip, v[partner], u[partner])
+        d = np.where(flip, u[partner], v[partner])
+        a = u[bad]
+        b = v[bad]
+        ok = (a != d) & (c != b)
+        for x, y in ((a, d), (c, b)):
+            newKey = (graph[bad] * keyBase + np.minimum(x, y)) * keyBase + np.maximum(x, y)
+            found = np.minimum(np.searchsorted(sortedKey, newKey), len(sortedKey) - 1)
+            ok &= sortedKey[found] != newKey
+        bad = bad[ok]
+        partner = partner[ok]
+        v[bad] = d[ok]
+        u[partner] = c[ok]
+        v[partner] = b[ok]
+    raise RuntimeError("Could not remove multi-edges after %d rounds" % maxRounds)
+
+def componentLabels(graph, u, v, sizes):
+    """It returns, for each node of each graph, the lowest global node index of its component.
+
+    Nodes are numbered globally, graph after graph. Labels are propagated to
+    neighbors and shortcut (label of label) until they are stable.
+    """
+    nodeStart = np.cumsum(sizes) - sizes
+    gu = nodeStart[graph] + u
+    gv = nodeStart[graph] + v
+    first = np.concatenate((gu, gv))
+    second = np.concatenate((gv, gu))
+    order = np.argsort(first)
+    first = first[order]
+    second = second[order]
+    starts = np.flatnonzero(np.diff(first, prepend=-1))
+    nodes = first[starts]
+    label = np.arange(int(sizes.sum()))
+    while True:
+        new = label.copy()
+        if len(nodes):
+            new[nodes] = np.minimum(new[nodes], np.minimum.reduceat(label[second], starts))
+        new = new[new]
+        if np.array_equal(new, label):
+            return label
+        label = new
+
+def connectGraph(u, v, size, rng, maxRounds=1000):
+    """It connects the components of one graph with double edge swaps, in place.
+
+    An edge (a, b) of the component of node 0 and an edge (c, d) of another
+    component become (a, c) and (b, d), keeping all degrees. It returns
+    whether the graph ended up connected (it cannot if degrees are below 2).
+    """
+    sizes = np.array([size])
+    graph = np.zeros(len(u), dtype=np.int64)
+    for i in range(maxRounds):
+        label = componentLabels(graph, u, v, sizes)
+        edgeLabel = label[u]
+        other = np.flatnonzero(edgeLabel != label[0])
+        if len(other) == 0:
+            return bool(np.all(label == 0))
+        same = np.flatnonzero(edgeLabel == label[0])
+        if len(same) == 0:
+            return False
+        e1 = same[rng.integers(len(same))]
+        e2 = other[rng.integers(len(other))]
+        b, c = v[e1], u[e2]
+        v[e1] = c
+        u[e2] = b
+    return False
+
+def randomRegularGraphs(sizes, degree, rng):
+    """It returns a random degree-regular graph for each of the given sizes of node sets.
+
+    All graphs are drawn at once with the configuration model, then made
+    simple with double edge swaps. Graphs of more than half the complete
+    graph degree are drawn as the complement of a sparser regular graph, and
+    graphs of at most degree+1 nodes are complete, as in networkx. Graphs
+    that come out disconnected are repaired with swaps between components.
+
+    Edges are returned as arrays (graph, u, v) of local node indices, sorted
+    by graph, along with a boolean array telling which graphs are connected.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    complete = sizes <= degree + 1
+    dense = ~complete & (2 * degree > sizes - 1)
+    degrees = np.where(dense, sizes - 1 - degree, degree)
+    if np.any((sizes * degrees)[~complete] % 2):
+        raise ValueError("n * d must be even")
+
+    # draw all sparse graphs, and the complement of dense ones, in one batch
+    ids = np.flatnonzero(~complete)
+    graph, u, v = configurationModel(sizes[ids], degrees[ids], rng)
+    removeMultiEdges(graph, u, v, sizes[ids], rng)
+    graph = ids[graph]
+
+    graphs = [graph[~dense[graph]]]
+    us = [u[~dense[graph]]]
+    vs = [v[~dense[graph]]]
+    for id in np.flatnonzero(dense | complete):
+        adjacency = np.zeros((sizes[id], sizes[id]), dtype=bool)
+        if dense[id]:
+            adjacency[u[graph == id], v[graph == id]] = True
+            adjacency |= adjacency.T
+        a, b = np.nonzero(np.triu(~adjacency, 1))
+        graphs.append(np.full(len(a), id))
+        us.append(a)
+        vs.append(b)
+    order = np.argsort(np.concatenate(graphs), kind="stable")
+    graph = np.concatenate(graphs)[order]
+    u = np.concatenate(us)[order]
+    v = np.concatenate(vs)[order]
+
+    label = componentLabels(graph, u, v, sizes)
+    components = np.bincount(np.repeat(np.arange(len(sizes)), sizes), weights=(label == np.arange(len(label))), minlength=len(sizes))
+    connected = components <= 1
+    edgeStart = np.searchsorted(graph, np.arange(len(sizes) + 1))
+    for id in np.flatnonzero(~connected):
+        if degrees[id] >= 2:
+            part = slice(edgeStart[id], edgeStart[id + 1])
+            connected[id] = connectGraph(u[part], v[part], sizes[id], rng)
+    return graph, u, v, connected
+
+
+class TopologyCache:
+    """This class stores line assignments and meshes on disk, for runs that share a topology.
+
+    An entry is a directory of .npy files, named after a hash of everything
+    the topology depends on, and loaded with mmap. Entries are written to a
+    temporary directory and then renamed, so parallel runs can share a cache.
+    """
+
+    version = 2 # to be increased when the way topologies are drawn changes
+
+    def __init__(self, directory, params):
+        """It initializes the cache entry of a topology described by the params dict."""
+        params = dict(params, version=self.version)
+        key = hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()
+        self.directory = directory
+        self.path = os.path.join(directory, key)
+
+    def exists(self):
+        """It returns whether the entry was saved."""
+        return os.path.isdir(self.path)
+
+    def load(self):
+        """It returns the arrays of the entry by name, mapped read-only."""
+        return {name[:-4]: np.load(os.path.join(self.path, name), mmap_mode="r")
+                for name in os.listdir(self.path) if name.endswith(".npy")}
+
+    def save(self, arrays):
+        """It saves the arrays of the entry, unless another run saved it first."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), array)
+        try:
+            os.rename(tmp, self.path)
+        except OSError:
+            shutil.rmtree(tmp)
@@ -1,13 +1,14 @@
 #!/bin/python3
 
+import bisect
 import random
 import collections
 import logging
 from DAS.block import *
+from DAS.patterns import getPattern
 from DAS.tools import shuffled, shuffledDict, unionOfSamples
 from bitarray.util import zeros
 from collections import deque
-from itertools import chain
 
 class Neighbor:
     """This class implements a node neighbor to monitor sent and received data.
@@ -17,6 +18,8 @@ class Neighbor:
     received from a link.
     """
 
+    __slots__ = ("node", "dim", "received", "sent", "known", "sendQueue", "pending", "rank", "active")
+
     def __repr__(self):
         """It returns the amount of sent and received data."""
         return "%d:%d/%d, q:%d" % (self.node.ID, self.sent.count(1), self.received.count(1), len(self.sendQueue))
@@ -25,10 +28,13 @@ class Neighbor:
         """It initializes the neighbor with the node and sets counters to zero."""
         self.node = v
         self.dim = dim # 0:row 1:col
-        self.receiving = zeros(blockSize)
         self.received = zeros(blockSize)
         self.sent = zeros(blockSize)
+        self.known = 0 # number of segments sent or received on the link
         self.sendQueue = deque()
+        self.pending = None # bitmap of queued segments, with Validator.pendingBitmaps
+        self.rank = 0 # position among the neighbors of the owner, see Validator.addNeighbor
+        self.active = False # listed in the activeQueues of the owner
 
 
 class Validator:
@@ -49,9 +55,8 @@ class Validator:
         FORMAT = "%(levelname)s : %(entity)s : %(message)s"
         self.ID = ID
         self.format = {"entity": "Val "+str(self.ID)}
-        self.block = Block(self.shape.blockSizeR, self.shape.blockSizeRK, self.shape.blockSizeC,  self.shape.blockSizeCK)
-        self.receivedBlock = Block(self.shape.blockSizeR, self.shape.blockSizeRK, self.shape.blockSizeC,  self.shape.blockSizeCK)
         self.receivedQueue = deque()
+        self.receivingLog = [] # (neighbor, lineID, id) of segments received on links in this step
         self.sendQueue = deque()
         self.amIproposer = amIproposer
         self.logger = logger
@@ -78,8 +83,36 @@ class Validator:
                     self.vColumnIDs.append(set(columns[i*self.shape.chiC:(i+1)*self.shape.chiC]) if columns else set(random.sample(range(self.shape.blockSizeR), self.shape.chiC)))
                 self.rowIDs = set.union(*self.vRowIDs)
                 self.columnIDs = set.union(*self.vColumnIDs)
+
+                # progress counters, updated as segments arrive (see segmentArrived)
+                self.arrived = 0
+                self.expected = len(self.rowIDs) * self.shape.blockSizeR + len(self.columnIDs) * self.shape.blockSizeC
+                self.validated = 0
+                self.rowMissing = {id: self.shape.blockSizeR for id in self.rowIDs}
+                self.columnMissing = {id: self.shape.blockSizeC for id in self.columnIDs}
+                self.rowValidators = collections.defaultdict(list)
+                self.columnValidators = collections.defaultdict(list)
+                for i in range(self.vpn):
+                    for id in self.vRowIDs[i]:
+                        self.rowValidators[id].append(i)
+                    for id in self.vColumnIDs[i]:
+                        self.columnValidators[id].append(i)
+                self.validatorMissingLines = [len(self.vRowIDs[i]) + len(self.vColumnIDs[i]) for i in range(self.vpn)]
+        if config.lineStorage and not amIproposer:
+            # only subscribed lines are ever read or written by a non-proposer
+            self.block = LineBlock(self.shape.blockSizeR, self.shape.blockSizeRK, self.shape.blockSizeC,  self.shape.blockSizeCK, self.rowIDs, self.columnIDs)
+            self.receivedBlock = LineBlock(self.shape.blockSizeR, self.shape.blockSizeRK, self.shape.blockSizeC,  self.shape.blockSizeCK, self.rowIDs, self.columnIDs)
+        else:
+            blockClass = DualBlock if config.blockLayout == "dual" else Block
+            self.block = blockClass(self.shape.blockSizeR, self.shape.blockSizeRK, self.shape.blockSizeC,  self.shape.blockSizeCK)
+            self.receivedBlock = Block(self.shape.blockSizeR, self.shape.blockSizeRK, self.shape.blockSizeC,  self.shape.blockSizeCK)
         self.rowNeighbors = collections.defaultdict(dict)
         self.columnNeighbors = collections.defaultdict(dict)
+        self.dirtyRows = set() # rows that became repairable since the last restore
+        self.dirtyColumns = set() # columns that became repairable since the last restore
+        self.needed = ({}, {}) # per dimension, lineID -> segments needed by some neighbor (see getNeeded)
+        self.neighborCount = 0
+        self.activeQueues = [] # (rank, lineID, neighbor) of neighbors with a non-empty sendQueue, by rank
 
         #statistics
         self.statsTxInSlot = 0
@@ -101,9 +134,12 @@ class Validator:
         self.bwUplink *= 1e3 / 8 * config.stepDuration / config.segmentSize
 
         self.repairOnTheFly = True
+        self.repairCascade = True # restore lines completed by repairs in the other dimension in the same step
         self.sendLineUntilR = self.shape.blockSizeRK # stop sending on a p2p link if at least this amount of samples passed
         self.sendLineUntilC = self.shape.blockSizeCK # stop sending on a p2p link if at least this amount of samples passed
         self.perNeighborQueue = True # queue incoming messages to outgoing connections on arrival (as typical GossipSub impl)
+        self.pendingBitmaps = False # keep per-neighbor queues as bitmaps of pending segments, deduplicated and filtered on insert
+        self.pendingFIFO = True # with pendingBitmaps, send pending segments in arrival order instead of segment order
         self.shuffleQueues = True # shuffle the order of picking from active queues of a sender node
         self.perNodeQueue = False # keep a global queue of incoming messages for later sequential dispatch
         self.shuffleLines = True # shuffle the order of rows/columns in each iteration while trying to send
@@ -116,61 +152,17 @@ class Validator:
         """It logs the assigned rows and columns."""
         if self.amIproposer == 1:
             self.logger.warning("I am a block proposer."% self.ID)
-        else:
+        elif self.logger.isEnabledFor(logging.DEBUG):
             self.logger.debug("Selected rows: "+str(self.rowIDs), extra=self.format)
             self.logger.debug("Selected columns: "+str(self.columnIDs), extra=self.format)
 
     def initBlock(self):
-        """It initializes the block for the proposer."""
+        """It initializes the block for the proposer, with the pattern of its failure model (see DAS/patterns.py)."""
         if self.amIproposer == 0:
             self.logger.warning("I am not a block proposer", extra=self.format)
         else:
             self.logger.debug("Creating block...", extra=self.format)
-            if self.shape.failureModel == "random":
-                order = [i for i in range(self.shape.blockSizeR * self.shape.blockSizeC)]
-                order = random.sample(order, int((1 - self.shape.failureRate/100) * len(order)))
-                for i in order:
-                    self.block.data[i] = 1
-            elif self.shape.failureModel == "sequential":
-                order = [i for i in range(self.shape.blockSizeR * self.shape.blockSizeC)]
-                order = order[:int((1 - self.shape.failureRate/100) * len(order))]
-                for i in order:
-                    self.block.data[i] = 1
-            elif self.shape.failureModel == "MEP": # Minimal size non-recoverable Erasure Pattern
-                for r in range(self.shape.blockSizeR):
-                    for c in range(self.shape.blockSizeC):
-                        if r > self.shape.blockSizeRK or c > self.shape.blockSizeCK:
-                            self.block.setSegment(r,c)
-            elif self.shape.failureModel == "MEP+1": # MEP +1 segment to make it recoverable
-                for r in range(self.shape.blockSizeR):
-                    for c in range(self.shape.blockSizeC):
-                        if r > self.shape.blockSizeRK or c > self.shape.blockSizeCK:
-                            self.block.setSegment(r,c)
-                self.block.setSegment(0, 0)
-            elif self.shape.failureModel == "DEP":
-                assert(self.shape.blockSizeR == self.shape.blockSizeC and self.shape.blockSizeRK == self.shape.blockSizeCK)
-                for r in range(self.shape.blockSizeR):
-                    for c in range(self.shape.blockSizeC):
-                        if (r+c) % self.shape.blockSizeR > self.shape.blockSizeRK:
-                            self.block.setSegment(r,c)
-            elif self.shape.failureModel == "DEP+1":
-                assert(self.shape.blockSizeR == self.shape.blockSizeC and self.shape.blockSizeRK == self.shape.blockSizeCK)
-                for r in range(self.shape.blockSizeR):
-                    for c in range(self.shape.blockSizeC):
-                        if (r+c) % self.shape.blockSizeR > self.shape.blockSizeRK:
-                            self.block.setSegment(r,c)
-                self.block.setSegment(0, 0)
-            elif self.shape.failureModel == "MREP": # Minimum size Recoverable Erasure Pattern
-                for r in range(self.shape.blockSizeR):
-                    for c in range(self.shape.blockSizeC):
-                        if r < self.shape.blockSizeRK or c < self.shape.blockSizeCK:
-                            self.block.setSegment(r,c)
-            elif self.shape.failureModel == "MREP-1": # make MREP non-recoverable
-                for r in range(self.shape.blockSizeR):
-                    for c in range(self.shape.blockSizeC):
-                        if r < self.shape.blockSizeRK or c < self.shape.blockSizeCK:
-                            self.block.setSegment(r,c)
-                self.block.setSegment(0, 0, 0)
+            self.block.setData(getPattern(self.shape))
 
             nbFailures = self.block.data.count(0)
             measuredFailureRate = nbFailures * 100 / (self.shape.blockSizeR * self.shape.blockSizeC)
@@ -189,32 +181,86 @@ class Validator:
         # register receive so that we are not sending back
         if rID in self.rowIDs:
             if src in self.rowNeighbors[rID]:
-                self.rowNeighbors[rID][src].receiving[cID] = 1
+                self.receivingLog.append((self.rowNeighbors[rID][src], rID, cID))
         if cID in self.columnIDs:
             if src in self.columnNeighbors[cID]:
-                self.columnNeighbors[cID][src].receiving[rID] = 1
+                self.receivingLog.append((self.columnNeighbors[cID][src], cID, rID))
         if not self.receivedBlock.getSegment(rID, cID):
             self.logger.trace("Recv new: %d->%d: %d,%d", src, self.ID, rID, cID, extra=self.format)
             self.receivedBlock.setSegment(rID, cID)
-            if self.perNodeQueue or self.perNeighborQueue:
-                self.receivedQueue.append((rID, cID))
+            self.receivedQueue.append((rID, cID))
         else:
             self.logger.trace("Recv DUP: %d->%d: %d,%d", src, self.ID, rID, cID, extra=self.format)
             self.statsRxDupInSlot += 1
         self.statsRxInSlot += 1
 
+    def addNeighbor(self, dim, lineID, val, blockSize):
+        """It adds val as a neighbor on row (dim 0) or column (dim 1) lineID.
+
+        Neighbors are ranked by dimension, then in the order they are added,
+        which is the order of rowNeighbors followed by columnNeighbors.
+        """
+        neigh = Neighbor(val, dim, blockSize)
+        neigh.rank = dim << 32 | self.neighborCount
+        if self.pendingBitmaps:
+            neigh.pending = zeros(blockSize)
+        self.neighborCount += 1
+        neighbors = self.columnNeighbors if dim else self.rowNeighbors
+        neighbors[lineID][val.ID] = neigh
+
+    def activateQueue(self, lineID, neigh):
+        """It lists the send queue of neigh among the active ones, keeping them by rank."""
+        neigh.active = True
+        bisect.insort(self.activeQueues, (neigh.rank, lineID, neigh))
+
+    def addToPending(self, rID, cID, neigh):
+        """Mark a segment as pending on a link, if it is still worth sending there.
+
+        The segment is queued at most once, and not at all if it was already
+        exchanged on the link. With pendingFIFO its index is also appended to
+        the sendQueue of the link, so the queue is never longer than the line.
+        """
+        i = rID if neigh.dim else cID
+        if not neigh.pending[i] and self.checkSegmentToNeigh(rID, cID, neigh):
+            if not neigh.active:
+                self.activateQueue(cID if neigh.dim else rID, neigh)
+            neigh.pending[i] = 1
+            if self.pendingFIFO:
+                neigh.sendQueue.append(i)
+
+    def popFromQueue(self, neigh):
+        """Remove and return the next segment index queued for a link."""
+        if not self.pendingBitmaps:
+            return neigh.sendQueue.popleft()
+        i = neigh.sendQueue.popleft() if self.pendingFIFO else neigh.pending.index(1)
+        neigh.pending[i] = 0
+        return i
+
     def addToSendQueue(self, rID, cID):
         """Queue a segment for forwarding."""
         if self.perNodeQueue:
             self.sendQueue.append((rID, cID))
 
-        if self.perNeighborQueue:
+        if self.perNeighborQueue and self.pendingBitmaps:
             if rID in self.rowIDs:
                 for neigh in self.rowNeighbors[rID].values():
+                    self.addToPending(rID, cID, neigh)
+
+            if cID in self.columnIDs:
+                for neigh in self.columnNeighbors[cID].values():
+                    self.addToPending(rID, cID, neigh)
+
+        elif self.perNeighborQueue:
+            if rID in self.rowIDs:
+                for neigh in self.rowNeighbors[rID].values():
+                    if not neigh.active:
+                        self.activateQueue(rID, neigh)
                     neigh.sendQueue.append(cID)
 
             if cID in self.columnIDs:
                 for neigh in self.columnNeighbors[cID].values():
+                    if not neigh.active:
+                        self.activateQueue(cID, neigh)
                     neigh.sendQueue.append(rID)
 
     def receiveRowsColumns(self):
@@ -225,19 +271,50 @@ class Validator:
             self.logger.trace("Receiving the data...", extra=self.format)
             #self.logger.debug("%s -> %s", self.block.data, self.receivedBlock.data, extra=self.format)
 
-            self.block.merge(self.receivedBlock)
-
-            for neighs in chain (self.rowNeighbors.values(), self.columnNeighbors.values()):
-                for neigh in neighs.values():
-                    neigh.received |= neigh.receiving
-                    neigh.receiving.setall(0)
-
-            # add newly received segments to the send queue
-            if self.perNodeQueue or self.perNeighborQueue:
-                while self.receivedQueue:
-                    (rID, cID) = self.receivedQueue.popleft()
+            # apply segments received on links in this step to the link state
+            for neigh, lineID, i in self.receivingLog:
+                if not neigh.received[i]:
+                    if not neigh.sent[i]:
+                        neigh.known += 1
+                    neigh.received[i] = 1
+                    self.needed[neigh.dim].pop(lineID, None)
+            self.receivingLog.clear()
+
+            # merge newly received segments in the block and add them to the send queue
+            while self.receivedQueue:
+                (rID, cID) = self.receivedQueue.popleft()
+                if not self.block.getSegment(rID, cID):
+                    self.block.setSegment(rID, cID)
+                    self.segmentArrived(rID, cID)
+                if self.perNodeQueue or self.perNeighborQueue:
                     self.addToSendQueue(rID, cID)
 
+    def segmentArrived(self, rID, cID):
+        """Update progress counters for a segment newly set in the block."""
+        self.needed[0].pop(rID, None)
+        self.needed[1].pop(cID, None)
+        if rID in self.rowIDs:
+            self.arrived += 1
+            self.rowMissing[rID] -= 1
+            if self.rowMissing[rID] == 0:
+                self.lineCompleted(self.rowValidators[rID])
+            elif self.rowMissing[rID] <= self.shape.blockSizeR - self.shape.blockSizeRK:
+                self.dirtyRows.add(rID)
+        if cID in self.columnIDs:
+            self.arrived += 1
+            self.columnMissing[cID] -= 1
+            if self.columnMissing[cID] == 0:
+                self.lineCompleted(self.columnValidators[cID])
+            elif self.columnMissing[cID] <= self.shape.blockSizeC - self.shape.blockSizeCK:
+                self.dirtyColumns.add(cID)
+
+    def lineCompleted(self, validators):
+        """Update validator counters for a line that became complete."""
+        for i in validators:
+            self.validatorMissingLines[i] -= 1
+            if self.validatorMissingLines[i] == 0:
+                self.validated += 1
+
     def updateStats(self):
         """It updates the stats related to sent and received data."""
         self.logger.debug("Stats: tx %d, rx %d", self.statsTxInSlot, self.statsRxInSlot, extra=self.format)
@@ -250,7 +327,7 @@ class Validator:
 
     def checkSegmentToNeigh(self, rID, cID, neigh):
         """Check if a segment should be sent to a neighbor."""
-        if (neigh.sent | neigh.received).count(1) >= (self.sendLineUntilC if neigh.dim else self.sendLineUntilR):
+        if neigh.known >= (self.sendLineUntilC if neigh.dim else self.sendLineUntilR):
             return False # sent enough, other side can restore
         i = rID if neigh.dim else cID
         if not neigh.sent[i] and not neigh.received[i] :
@@ -262,7 +339,10 @@ class Validator:
         """Send segment to a neighbor (without checks)."""
         self.logger.trace("sending %d/%d to %d", rID, cID, neigh.node.ID, extra=self.format)
         i = rID if neigh.dim else cID
+        if not neigh.sent[i] and not neigh.received[i]:
+            neigh.known += 1
         neigh.sent[i] = 1
+        self.needed[neigh.dim].pop(cID if neigh.dim else rID, None)
         neigh.node.receiveSegment(rID, cID, self.ID)
         self.statsTxInSlot += 1
 
@@ -308,32 +388,56 @@ class Validator:
         of flows per topic and per peer. A per-peer model might be closer to the
         reality of libp2p implementations where topics between two nodes are
         multiplexed over the same transport.
+
+        Non-empty queues are kept in activeQueues by neighbor rank, so that
+        idle neighbors are never scanned, while each pass still shuffles the
+        same list, in the same order, as a scan of all the neighbors would.
         """
         progress = True
         while (progress):
             progress = False
 
+            # drop the queues emptied by the previous pass
             queues = []
-            # collect and shuffle
-            for rID, neighs in self.rowNeighbors.items():
-                for neigh in neighs.values():
-                    if (neigh.sendQueue):
-                        queues.append((0, rID, neigh))
-
-            for cID, neighs in self.columnNeighbors.items():
-                for neigh in neighs.values():
-                    if (neigh.sendQueue):
-                        queues.append((1, cID, neigh))
-
-            for dim, lineID, neigh in shuffled(queues, self.shuffleQueues):
-                if dim == 0:
-                    self.checkSendSegmentToNeigh(lineID, neigh.sendQueue.popleft(), neigh)
+            for q in self.activeQueues:
+                if (q[2].pending.any() if self.pendingBitmaps else q[2].sendQueue):
+                    queues.append(q)
+                else:
+                    q[2].active = False
+            self.activeQueues = queues
+
+            for _, lineID, neigh in shuffled(queues, self.shuffleQueues):
+                if neigh.dim == 0:
+                    self.checkSendSegmentToNeigh(lineID, self.popFromQueue(neigh), neigh)
                 else:
-                    self.checkSendSegmentToNeigh(neigh.sendQueue.popleft(), lineID, neigh)
+                    self.checkSendSegmentToNeigh(self.popFromQueue(neigh), lineID, neigh)
                 progress = True
                 if self.statsTxInSlot >= self.bwUplink:
                     return
 
+    def getNeeded(self, dim, lineID, neighs):
+        """Return the segments of a line we have and at least one neighbor still needs.
+
+        The result is cached per line, and the cache entry is dropped whenever
+        something changes on the line: a segment is sent, received from a
+        neighbor, or added to the block.
+        """
+        needed = self.needed[dim].get(lineID)
+        if needed is None:
+            if dim == 0:
+                line = self.getRow(lineID)
+                sendLineUntil = self.sendLineUntilR
+            else:
+                line = self.getColumn(lineID)
+                sendLineUntil = self.sendLineUntilC
+            needed = zeros(len(line))
+            for neigh in neighs.values():
+                if neigh.known < sendLineUntil:
+                    needed |= ~(neigh.received | neigh.sent)
+            needed &= line
+            self.needed[dim][lineID] = needed
+        return needed
+
     def runSegmentShuffleScheduler(self):
         """ Schedule chunks for sending.
 
@@ -346,30 +450,12 @@ class Validator:
                 # yields list of segments to send as (dim, lineID, id)
                 segmentsToSend = []
                 for rID, neighs in self.rowNeighbors.items():
-                    line = self.getRow(rID)
-                    needed = zeros(self.shape.blockSizeR)
-                    for neigh in neighs.values():
-                        sentOrReceived = neigh.received | neigh.sent
-                        if sentOrReceived.count(1) < self.sendLineUntilR:
-                            needed |= ~sentOrReceived
-                    needed &= line
-                    if (needed).any():
-                        for i in range(len(needed)):
-                            if needed[i]:
-                                segmentsToSend.append((0, rID, i))
+                    for i in self.getNeeded(0, rID, neighs).search(1):
+                        segmentsToSend.append((0, rID, i))
 
                 for cID, neighs in self.columnNeighbors.items():
-                    line = self.getColumn(cID)
-                    needed = zeros(self.shape.blockSizeC)
-                    for neigh in neighs.values():
-                        sentOrReceived = neigh.received | neigh.sent
-                        if sentOrReceived.count(1) < self.sendLineUntilC:
-                            needed |= ~sentOrReceived
-                    needed &= line
-                    if (needed).any():
-                        for i in range(len(needed)):
-                            if needed[i]:
-                                segmentsToSend.append((1, cID, i))
+                    for i in self.getNeeded(1, cID, neighs).search(1):
+                        segmentsToSend.append((1, cID, i))
 
                 return segmentsToSend
 
@@ -482,10 +568,13 @@ class Validator:
                 self.logger.debug("Column %d: %s", id, self.getColumn(id), extra=self.format)
 
     def restoreRows(self):
-        """It restores the rows assigned to the validator, that can be repaired."""
+        """It restores the rows assigned to the validator, that can be repaired.
+
+        Only rows that became repairable since the last restore are checked.
+        """
         if self.repairOnTheFly:
-            for id in self.rowIDs:
-                self.restoreRow(id)
+            while self.dirtyRows:
+                self.restoreRow(self.dirtyRows.pop())
 
     def restoreRow(self, id):
         """Restore a given row if repairable."""
@@ -496,14 +585,23 @@ class Validator:
             for i in range(len(rep)):
                 if rep[i]:
                     self.logger.trace("Rep: %d,%d", id, i, extra=self.format)
+                    self.segmentArrived(id, i)
                     self.addToSendQueue(id, i)
             # self.statsRepairInSlot += rep.count(1)
+        self.dirtyRows.discard(id)
 
     def restoreColumns(self):
-        """It restores the columns assigned to the validator, that can be repaired."""
+        """It restores the columns assigned to the validator, that can be repaired.
+
+        Only columns that became repairable since the last restore are checked.
+        With repairCascade, rows made repairable by a column repair are restored
+        in the same pass, and so on until no line can be repaired.
+        """
         if self.repairOnTheFly:
-            for id in self.columnIDs:
-                self.restoreColumn(id)
+            while self.dirtyColumns:
+                self.restoreColumn(self.dirtyColumns.pop())
+                if self.repairCascade:
+                    self.restoreRows()
 
     def restoreColumn(self, id):
         """Restore a given column if repairable."""
@@ -514,11 +612,20 @@ class Validator:
             for i in range(len(rep)):
                 if rep[i]:
                     self.logger.trace("Rep: %d,%d", i, id, extra=self.format)
+                    self.segmentArrived(i, id)
                     self.addToSendQueue(i, id)
             # self.statsRepairInSlot += rep.count(1)
+        self.dirtyColumns.discard(id)
+
+    def getStatus(self):
+        """It returns the arrived/expected samples and validated validators from the progress counters."""
+        return self.arrived, self.expected, self.validated
 
     def checkStatus(self):
-        """It checks how many expected/arrived samples are for each assigned row/column."""
+        """It checks how many expected/arrived samples are for each assigned row/column.
+
+        This rescans all assigned lines, see getStatus for the counter based equivalent.
+        """
 
         def checkStatus(columnIDs, rowIDs):
             arrived = 0
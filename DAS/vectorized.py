@@ -0,0 +1,493 @@
+#!/bin/python3
+
+import copy
+import random
+import numpy as np
+from DAS.simulator import Simulator
+from DAS.validator import Validator
+
+# Number of ones in each byte value, used to count bits of packed lines
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def countBits(matrix):
+    """It returns the number of ones in each row of a packed bit matrix."""
+    return POPCOUNT[matrix].sum(axis=1, dtype=np.int64)
+
+def getBits(matrix, rows, cols):
+    """It returns the bits at (rows, cols) of a packed bit matrix."""
+    return (matrix[rows, cols >> 3] >> (7 - (cols & 7))) & 1
+
+def setBits(matrix, rows, cols):
+    """It sets the bits at (rows, cols) of a packed bit matrix.
+
+    Several bits of the same byte can be set in one call, so bits are
+    first OR-reduced per byte, then applied on the flat matrix.
+    """
+    if len(rows) == 0:
+        return
+    idx = rows * matrix.shape[1] + (cols >> 3)
+    bits = (128 >> (cols & 7)).astype(np.uint8)
+    order = np.argsort(idx, kind="stable")
+    idx = idx[order]
+    bits = bits[order]
+    first = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+    flat = matrix.reshape(-1)
+    flat[idx[first]] |= np.bitwise_or.reduceat(bits, first)
+
+def rankInGroups(groups, order):
+    """It returns the position of each element inside its group, given an order sorting by group."""
+    g = groups[order]
+    start = np.r_[True, g[1:] != g[:-1]]
+    positions = np.arange(len(g))
+    rank = np.empty(len(g), dtype=np.int64)
+    rank[order] = positions - np.maximum.accumulate(np.where(start, positions, 0))
+    return rank
+
+class VectorizedSimulator(Simulator):
+    """This class implements the DAS simulator on NumPy arrays.
+
+    Instead of one Validator object per node, the state of the network is kept
+    per line membership, i.e. per (node, row) and (node, column) pair. Each
+    membership has a packed bit line, and mesh links (see Mesh) are arrays of
+    membership indices with their sent/received state in packed bit matrices. Send,
+    receive and restore are then whole-network array operations. Dimensions
+    are indexed as in Neighbor (0:row 1:col).
+
+    Line assignment and topology use the same random draws as the Simulator,
+    so both engines simulate the same network for a given seed. Sending
+    follows the schedulers of Validator.send. Segments a node receives or
+    repairs are first queued to each of its neighbors in their topics
+    (perNeighborQueue), and queues are served round-robin, in random order.
+    The remaining bandwidth then goes to the segment shuffle scheduler: each
+    node sends every useful segment to one neighbor in random order, before
+    sending copies to other neighbors, until its uplink bandwidth is used.
+
+    The engines draw random numbers differently, so they give the same
+    results in distribution, not run by run. Queues are kept as bitmaps of
+    pending segments (as with pendingBitmaps), served in random rather than
+    arrival order, and the shuffle scheduler state is not kept across steps,
+    so times to availability can be slightly longer: results of both engines
+    should not be mixed.
+    """
+
+    def initValidators(self):
+        """It assigns rows and columns to all nodes and initializes their lines.
+
+        Everything is computed on the arrays of assignLines, so that no per
+        node object is built, except for the proposer and its block.
+        """
+        shape = self.shape
+        nn = shape.numberNodes
+        self.validators = []
+        self.proposer = Validator(self.proposerID, 1, self.logger, shape, self.config)
+        valNode, rows, columns = self.assignLines()
+
+        nodes = np.arange(nn)
+        self.isNode = nodes != self.proposerID
+        # same class rules as in Validator
+        self.nodeClass = np.where(nodes <= nn * shape.class1ratio, 1, 2)
+        self.nodeClass[self.proposerID] = 0
+        self.vpn = np.bincount(valNode, minlength=nn)
+        self.bwUplink = np.where(self.nodeClass == 1, shape.bwUplink1, shape.bwUplink2).astype(float)
+        self.bwUplink[self.proposerID] = shape.bwUplinkProd
+        self.bwUplink *= 1e3 / 8 * self.config.stepDuration / self.config.segmentSize
+        self.budget = np.ceil(self.bwUplink).astype(np.int64)
+
+        self.lineSize = [shape.blockSizeR, shape.blockSizeC]
+        self.lineCount = [shape.blockSizeC, shape.blockSizeR]
+        self.sendLineUntil = [shape.blockSizeRK, shape.blockSizeCK]
+        self.fullLine = [np.packbits(np.ones(l, dtype=bool)) for l in self.lineSize]
+        self.memberNode = []
+        self.memberLine = []
+        self.memberOf = []
+        self.data = []
+        self.valMember = []
+        self.valOwner = []
+        for dim, lines in enumerate((rows, columns)):
+            # memberships of a topic are contiguous and in node order, the proposer has all lines
+            keys = np.concatenate(((lines * nn + valNode[:, None]).ravel(), np.arange(self.lineCount[dim]) * nn + self.proposerID))
+            keys = np.unique(keys)
+            nodes = keys % nn
+            lines = keys // nn
+            memberOf = np.full((nn, self.lineCount[dim]), -1, dtype=np.int32)
+            memberOf[nodes, lines] = np.arange(len(nodes))
+            self.memberNode.append(nodes)
+            self.memberLine.append(lines)
+            self.memberOf.append(memberOf)
+            self.data.append(np.zeros((len(nodes), len(self.fullLine[dim])), dtype=np.uint8))
+
+            # per validator line memberships, to count validated validators
+            validatorLines = (rows, columns)[dim]
+            self.valMember.append(memberOf[valNode[:, None], validatorLines].ravel())
+            self.valOwner.append(np.repeat(np.arange(len(valNode)), validatorLines.shape[1]))
+        self.validatorCnt = len(valNode)
+        self.expected = np.zeros(nn, dtype=np.int64)
+        for dim in (0, 1):
+            self.expected += np.bincount(self.memberNode[dim], minlength=nn) * self.lineSize[dim]
+        self.logger.debug("Validators initialized.", extra=self.format)
+
+    def initNetwork(self):
+        """It initializes the mesh links of each row and column topic.
+
+        Links go between line memberships, and are grouped per topic as in
+        Mesh, so the sent/received rows of a topic are one contiguous block.
+        """
+        channels = [[], []]
+        for dim in (0, 1):
+            bounds = np.searchsorted(self.memberLine[dim], np.arange(self.lineCount[dim] + 1))
+            for id in range(self.lineCount[dim]):
+                nodes = self.memberNode[dim][bounds[id]:bounds[id+1]]
+                if self.proposerPublishOnly:
+                    nodes = nodes[nodes != self.proposerID]
+                channels[dim].append(nodes.tolist())
+        self.meshes = self.initMeshes(*channels)
+
+        self.linkSrc = [self.memberOf[dim][mesh.src, mesh.line].astype(np.int64) for dim, mesh in enumerate(self.meshes)]
+        self.linkDst = [self.memberOf[dim][mesh.dst, mesh.line].astype(np.int64) for dim, mesh in enumerate(self.meshes)]
+        self.linkRev = [mesh.rev for mesh in self.meshes]
+        self.sent = [np.zeros((len(mesh), len(self.fullLine[dim])), dtype=np.uint8) for dim, mesh in enumerate(self.meshes)]
+        self.received = [np.zeros((len(mesh), len(self.fullLine[dim])), dtype=np.uint8) for dim, mesh in enumerate(self.meshes)]
+        # per link, segments queued to be forwarded on it (see queueSegments)
+        self.pending = [np.zeros((len(mesh), len(self.fullLine[dim])), dtype=np.uint8) for dim, mesh in enumerate(self.meshes)]
+        self.initQueues()
+
+    def initQueues(self):
+        """It indexes the outgoing links of each line membership, to queue segments on them."""
+        self.outLinks = []
+        self.outStart = []
+        for dim in (0, 1):
+            outLinks = np.argsort(self.linkSrc[dim], kind="stable")
+            self.outLinks.append(outLinks)
+            self.outStart.append(np.searchsorted(self.linkSrc[dim][outLinks], np.arange(len(self.memberNode[dim]) + 1)))
+
+    def prepareRun(self):
+        """It loads the proposer block in its lines, returning the number of missing samples."""
+        self.proposer.initBlock()
+        block = np.unpackbits(np.frombuffer(self.proposer.block.data.tobytes(), dtype=np.uint8),
+                              count=self.shape.blockSizeR * self.shape.blockSizeC)
+        block = block.reshape(self.shape.blockSizeC, self.shape.blockSizeR)
+        for dim, lines in enumerate((block, block.T)):
+            members = self.memberOf[dim][self.proposerID]
+            self.data[dim][members] = np.packbits(lines, axis=1)
+        self.repairable = [self.memberNode[dim] != self.proposerID for dim in (0, 1)]
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        self.statsTx = np.zeros(self.shape.numberNodes, dtype=np.int64)
+        self.statsRx = np.zeros(self.shape.numberNodes, dtype=np.int64)
+        self.statsRxDup = np.zeros(self.shape.numberNodes, dtype=np.int64)
+        return self.getProgress()[0]
+
+    def send(self):
+        """It selects the segments sent in this step and delivers them.
+
+        Per neighbor queues are served first, then the segment shuffle
+        scheduler uses the remaining bandwidth. Segments are delivered at
+        the end of the step, so that none is forwarded in the step it arrives.
+        """
+        budget = self.budget.copy()
+        picks = [[], []]
+        for scheduler in (self.selectQueued, self.selectShuffled):
+            link, seg, dim, node, group = scheduler()
+            if len(link) == 0:
+                continue
+            selected = self.selectWithinBudget(node, group, budget)
+            budget -= np.bincount(node[selected], minlength=self.shape.numberNodes)
+            for d in (0, 1):
+                pick = selected[dim[selected] == d]
+                setBits(self.sent[d], link[pick], seg[pick])
+                picks[d].append((link[pick], seg[pick]))
+        self.statsTx += self.budget - budget
+
+        for d in (0, 1):
+            if picks[d]:
+                self.deliver(d, np.concatenate([l for l, _ in picks[d]]), np.concatenate([s for _, s in picks[d]]))
+
+    def getCandidates(self, lines=None):
+        """It returns the segments worth sending on each link, among the given bit lines per link (all if None).
+
+        A segment is worth sending on a link if its source has it, it was
+        neither sent nor received on the link, and not enough segments were
+        exchanged on the link for the other side to restore the line.
+        Candidates are returned as arrays of links, segments, dimensions,
+        source nodes and source memberships (numbered across dimensions).
+        """
+        links = []
+        segments = []
+        dims = []
+        nodes = []
+        sources = []
+        for dim in (0, 1):
+            known = self.sent[dim] | self.received[dim]
+            candidates = self.data[dim][self.linkSrc[dim]] & ~known
+            if lines is not None:
+                candidates &= lines[dim]
+            candidates[countBits(known) >= self.sendLineUntil[dim]] = 0  # sent enough, other side can restore
+            active = np.flatnonzero(candidates.any(axis=1))
+            li, seg = np.nonzero(np.unpackbits(candidates[active], axis=1, count=self.lineSize[dim]))
+            links.append(active[li])
+            segments.append(seg)
+            dims.append(np.full(len(li), dim))
+            src = self.linkSrc[dim][active[li]]
+            nodes.append(self.memberNode[dim][src])
+            sources.append(src + dim * len(self.memberNode[0]))
+        return (np.concatenate(links), np.concatenate(segments), np.concatenate(dims),
+                np.concatenate(nodes), np.concatenate(sources))
+
+    def selectQueued(self):
+        """It returns the candidates of the per neighbor queues, and the queue of each, dropping the queued segments not worth sending anymore."""
+        link, seg, dim, node, src = self.getCandidates(self.pending)
+        for d in (0, 1):
+            self.pending[d][:] = 0
+            setBits(self.pending[d], link[dim == d], seg[dim == d])
+        return link, seg, dim, node, link * 2 + dim
+
+    def selectShuffled(self):
+        """It returns the candidates of the segment shuffle scheduler, all segments worth sending, and the (membership, segment) pair of each."""
+        link, seg, dim, node, src = self.getCandidates()
+        return link, seg, dim, node, src * max(self.lineSize) + seg
+
+    def selectWithinBudget(self, node, group, budget):
+        """It returns the indices of the candidates that nodes send within their remaining budget.
+
+        Nodes with more candidates than budget send in rounds, one candidate
+        of each group per round: queued segments one per queue (round-robin
+        between queues), others each (membership, segment) pair first to one
+        neighbor, then to a second one, etc. Within a round, the order is
+        random.
+        """
+        counts = np.bincount(node, minlength=self.shape.numberNodes)
+        over = np.flatnonzero(counts[node] > budget[node])
+        selected = np.flatnonzero(counts[node] <= budget[node])
+        if len(over):
+            group = group[over]
+            rand = self.drawTieBreaks(node[over])
+            rank = rankInGroups(group, np.argsort(group << 20 | rand, kind="stable"))
+            order = np.argsort(node[over] << 26 | np.minimum(rank, 63) << 20 | rand, kind="stable")
+            keep = order[rankInGroups(node[over], order)[order] < budget[node[over][order]]]
+            selected = np.r_[selected, over[keep]]
+        return selected
+
+    def drawTieBreaks(self, node):
+        """It returns the random keys ordering candidate segments of the given source nodes."""
+        return self.rng.integers(0, 1 << 20, len(node))
+
+    def deliver(self, dim, link, seg):
+        """It delivers segments sent on the given links, updating link and node state."""
+        setBits(self.sent[dim], link, seg)
+        rev = self.linkRev[dim][link]
+        setBits(self.received[dim], rev[rev >= 0], seg[rev >= 0])
+
+        dst = self.linkDst[dim][link]
+        node = self.memberNode[dim][dst]
+        line = self.memberLine[dim][dst]
+        rID, cID = (line, seg) if dim == 0 else (seg, line)
+        had = getBits(self.data[dim], dst, seg)
+        key = (node * self.shape.blockSizeC + rID) * self.shape.blockSizeR + cID
+        first = np.zeros(len(key), dtype=bool)
+        first[np.unique(key, return_index=True)[1]] = True
+        new = first & (had == 0)
+        self.statsRx += np.bincount(node, minlength=self.shape.numberNodes)
+        self.statsRxDup += np.bincount(node[~new], minlength=self.shape.numberNodes)
+        self.setSegments(node[new], rID[new], cID[new])
+        self.queueSegments(node[new], rID[new], cID[new])
+
+    def queueSegments(self, node, rID, cID):
+        """It queues segments arrived at nodes, to be forwarded to all their neighbors in the row and column topics."""
+        for dim, lineID, pos in ((0, rID, cID), (1, cID, rID)):
+            member = self.memberOf[dim][node, lineID]
+            pos = pos[member >= 0]
+            member = member[member >= 0]
+            start = self.outStart[dim][member]
+            counts = self.outStart[dim][member + 1] - start
+            first = np.repeat(start - np.cumsum(counts) + counts, counts)
+            links = self.outLinks[dim][first + np.arange(counts.sum())]
+            setBits(self.pending[dim], links, np.repeat(pos, counts))
+
+    def setSegments(self, node, rID, cID):
+        """It sets segments in both the row and the column lines of the nodes, if subscribed."""
+        for dim, lineID, pos in ((0, rID, cID), (1, cID, rID)):
+            member = self.memberOf[dim][node, lineID]
+            setBits(self.data[dim], member[member >= 0], pos[member >= 0])
+
+    def restore(self, dim):
+        """It repairs all lines of a dimension with enough segments, also updating crossing lines."""
+        counts = countBits(self.data[dim])
+        rep = np.flatnonzero((counts >= self.sendLineUntil[dim]) & (counts < self.lineSize[dim]) & self.repairable[dim])
+        if len(rep) == 0:
+            return
+        missing = self.fullLine[dim] & ~self.data[dim][rep]
+        self.data[dim][rep] = self.fullLine[dim]
+        mi, pos = np.nonzero(np.unpackbits(missing, axis=1, count=self.lineSize[dim]))
+        node = self.memberNode[dim][rep[mi]]
+        line = self.memberLine[dim][rep[mi]]
+        other = self.memberOf[1-dim][node, pos]
+        setBits(self.data[1-dim], other[other >= 0], line[other >= 0])
+        rID, cID = (line, pos) if dim == 0 else (pos, line)
+        self.queueSegments(node, rID, cID)
+
+    def step(self, steps):
+        """It runs the send, receive and restore phases of a time step."""
+        self.logger.debug("PHASE SEND/RECEIVE %d" % steps, extra=self.format)
+        self.send()
+        self.logger.debug("PHASE RESTORE %d" % steps, extra=self.format)
+        self.restore(0)
+        self.restore(1)
+
+    def getTrafficStats(self):
+        """It returns the TX and RX statistics of the current time step per node class."""
+        def maxOrNan(l):
+            return np.max(l) if len(l) else np.NaN
+        def meanOrNan(l):
+            return np.mean(l) if len(l) else np.NaN
+
+        trafficStats = {}
+        for cl in range(0,3):
+            Tx = self.statsTx[self.nodeClass == cl]
+            Rx = self.statsRx[self.nodeClass == cl]
+            RxDup = self.statsRxDup[self.nodeClass == cl]
+            trafficStats[cl] = {
+                "Tx": {"mean": meanOrNan(Tx), "max": maxOrNan(Tx)},
+                "Rx": {"mean": meanOrNan(Rx), "max": maxOrNan(Rx)},
+                "RxDup": {"mean": meanOrNan(RxDup), "max": maxOrNan(RxDup)},
+                }
+        return trafficStats
+
+    def updateStats(self):
+        """It resets the TX and RX statistics for the next time step."""
+        self.statsTx[:] = 0
+        self.statsRx[:] = 0
+        self.statsRxDup[:] = 0
+
+    def getProgress(self):
+        """It returns the progress metrics of the simulation (see Observer.getProgress)."""
+        nn = self.shape.numberNodes
+        arrived = np.zeros(nn, dtype=np.int64)
+        notFull = np.zeros(self.validatorCnt, dtype=np.int64)
+        for dim in (0, 1):
+            counts = countBits(self.data[dim])
+            arrived += np.bincount(self.memberNode[dim], weights=counts, minlength=nn).astype(np.int64)
+            lineNotFull = counts < self.lineSize[dim]
+            notFull += np.bincount(self.valOwner[dim], weights=lineNotFull[self.valMember[dim]], minlength=self.validatorCnt).astype(np.int64)
+        arrived = arrived[self.isNode]
+        expected = self.expected[self.isNode]
+        ready = arrived == expected
+        missingSamples = int(expected.sum() - arrived.sum())
+        sampleProgress = arrived.sum() / expected.sum()
+        nodeProgress = ready.sum() / (nn-1)
+        validatorAllProgress = self.vpn[self.isNode][ready].sum() / self.validatorCnt
+        validatorProgress = (notFull == 0).sum() / self.validatorCnt
+        return missingSamples, sampleProgress, nodeProgress, validatorAllProgress, validatorProgress
+
+    def getReachable(self):
+        """It returns the best outcome possible with the block released by the proposer (see Simulator.getReachable)."""
+        recoverable = self.proposer.block.getRecoverable()
+        lineMissing = [
+            np.array([recoverable.getRow(id).count(0) for id in range(self.shape.blockSizeC)]),
+            np.array([recoverable.getColumn(id).count(0) for id in range(self.shape.blockSizeR)])]
+        missingSamples = 0
+        notFull = np.zeros(self.validatorCnt, dtype=np.int64)
+        for dim in (0, 1):
+            missing = lineMissing[dim][self.memberLine[dim]]
+            missingSamples += int(missing[self.isNode[self.memberNode[dim]]].sum())
+            notFull += np.bincount(self.valOwner[dim], weights=missing[self.valMember[dim]] > 0, minlength=self.validatorCnt).astype(np.int64)
+        return missingSamples, (notFull == 0).sum() / self.validatorCnt
+
+    def printDiagnostics(self):
+        """Print the nodes missing samples when a block does not become available"""
+        missing = self.expected.copy()
+        for dim in (0, 1):
+            missing -= np.bincount(self.memberNode[dim], weights=countBits(self.data[dim]), minlength=self.shape.numberNodes).astype(np.int64)
+        for i in np.flatnonzero(missing * self.isNode):
+            self.logger.warning("Node %d is missing %d samples" % (i, missing[i]), extra=self.format)
+
+
+class ReplicaBatch(VectorizedSimulator):
+    """This class advances several vectorized simulations together.
+
+    Replicas are simulations of the same shape with different runs (hence
+    seeds), prepared for their first step. Their arrays are stacked into the
+    ones of one network, their disjoint union, and each replica keeps views
+    into them. A step of the batch then runs the step of all replicas with
+    the same array operations, while each replica computes its own progress
+    and result. Random draws of a replica come from its own generator, in
+    the order of its own run, so results are the same as with run().
+    """
+
+    def __init__(self, replicas):
+        """It stacks the state of the replicas, which must have the same shape apart from the run."""
+        first = replicas[0]
+        nn = first.shape.numberNodes
+        self.replicas = replicas
+        self.shape = copy.copy(first.shape)
+        self.shape.numberNodes = nn * len(replicas)
+        self.config = first.config
+        self.logger = first.logger
+        self.format = first.format
+        self.lineSize = first.lineSize
+        self.lineCount = first.lineCount
+        self.sendLineUntil = first.sendLineUntil
+        self.fullLine = first.fullLine
+        self.replicaOf = np.repeat(np.arange(len(replicas)), nn)
+        self.rngs = [r.rng for r in replicas]
+        self.budget = np.concatenate([r.budget for r in replicas])
+        for name in ("statsTx", "statsRx", "statsRxDup"):
+            stacked = np.concatenate([getattr(r, name) for r in replicas])
+            setattr(self, name, stacked)
+            for k, r in enumerate(replicas):
+                setattr(r, name, stacked[k*nn:(k+1)*nn])
+
+        self.memberBounds = []
+        for name in ("memberNode", "memberLine", "memberOf", "data", "repairable", "linkSrc", "linkDst", "linkRev", "sent", "received", "pending"):
+            setattr(self, name, [])
+        for dim in (0, 1):
+            memberBounds = np.cumsum([0] + [len(r.memberNode[dim]) for r in replicas])
+            linkBounds = np.cumsum([0] + [len(r.linkSrc[dim]) for r in replicas])
+            self.memberBounds.append(memberBounds)
+            self.memberNode.append(np.concatenate([r.memberNode[dim] + k*nn for k, r in enumerate(replicas)]))
+            self.memberLine.append(np.concatenate([r.memberLine[dim] for r in replicas]))
+            self.memberOf.append(np.concatenate([np.where(r.memberOf[dim] >= 0, r.memberOf[dim] + memberBounds[k], -1)
+                                                 for k, r in enumerate(replicas)]))
+            self.repairable.append(np.concatenate([r.repairable[dim] for r in replicas]))
+            self.linkSrc.append(np.concatenate([r.linkSrc[dim] + memberBounds[k] for k, r in enumerate(replicas)]))
+            self.linkDst.append(np.concatenate([r.linkDst[dim] + memberBounds[k] for k, r in enumerate(replicas)]))
+            self.linkRev.append(np.concatenate([np.where(r.linkRev[dim] >= 0, r.linkRev[dim] + linkBounds[k], -1)
+                                                for k, r in enumerate(replicas)]))
+            for name, bounds in (("data", memberBounds), ("sent", linkBounds), ("received", linkBounds), ("pending", linkBounds)):
+                stacked = np.concatenate([getattr(r, name)[dim] for r in replicas])
+                getattr(self, name).append(stacked)
+                for k, r in enumerate(replicas):
+                    getattr(r, name)[dim] = stacked[bounds[k]:bounds[k+1]]
+        self.initQueues()
+
+    def drawTieBreaks(self, node):
+        """It returns the random keys ordering candidate segments, drawn from the generator of their replica."""
+        rand = np.empty(len(node), dtype=np.int64)
+        replica = self.replicaOf[node]
+        for k in np.unique(replica):
+            mask = replica == k
+            rand[mask] = self.rngs[k].integers(0, 1 << 20, np.count_nonzero(mask))
+        return rand
+
+    def stopReplica(self, k):
+        """It empties the lines of a finished replica, so that it does not send anything anymore."""
+        for dim in (0, 1):
+            self.data[dim][self.memberBounds[dim][k]:self.memberBounds[dim][k+1]] = 0
+
+    def run(self, loops):
+        """It advances the main loops of the replicas (see Simulator.runSteps) together, returning their results."""
+        results = [None] * len(loops)
+        steps = {}
+        def advance(k):
+            try:
+                steps[k] = next(loops[k])
+            except StopIteration as stop:
+                results[k] = stop.value
+                steps.pop(k, None)
+                self.stopReplica(k)
+
+        for k in range(len(loops)):
+            advance(k)
+        while steps:
+            self.step(next(iter(steps.values())))
+            for k in list(steps):
+                advance(k)
+        return results
@@ -3,6 +3,7 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+from DAS.results import ResultIndex
 
 def plotData(conf):
     plt.clf()
@@ -29,11 +30,22 @@ def plotData(conf):
 class Visualizor:
     """This class helps the visualization of the results"""
 
-    def __init__(self, execID, config, results):
-        """Initialize the visualizer module"""
+    # shape parameters by their name in the shape representation
+    shapeParameters = {"bsrn": "blockSizeR", "bsrk": "blockSizeRK", "bscn": "blockSizeC", "bsck": "blockSizeCK",
+                       "nn": "numberNodes", "fm": "failureModel", "fr": "failureRate", "c1r": "class1ratio",
+                       "chir": "chiR", "chic": "chiC", "vpn1": "vpn1", "vpn2": "vpn2", "bwupprod": "bwUplinkProd",
+                       "bwup1": "bwUplink1", "bwup2": "bwUplink2", "nd": "netDegree", "r": "run"}
+
+    def __init__(self, execID, config, results, index=None):
+        """Initialize the visualizer module
+
+        The index of the results (see ResultIndex) can be given instead of
+        the results themselves, for the plots that only query it.
+        """
         self.execID = execID
         self.config = config
         self.results = results
+        self.index = index
         os.makedirs("results/"+self.execID+"/plots", exist_ok=True)
     
     def __get_attrbs__(self, result):
@@ -44,30 +56,44 @@ class Visualizor:
         return d
 
     def plotHeatmaps(self, x, y):
-        """Plot the heatmap using the parameters given as x axis and y axis"""
-        print("Plotting heatmap "+x+" vs "+y)
-        #Find the location of x in shape
-        #Find the location of y in shape
-        #Find the location od r in shape
-
-        #Loop over all results
-            #Add unique values foir every parameter
-
-        #Find number of runs from r
-        #If number of values for x and y > 3 then plot heatmap, otherwise finish
-
-        #Create a 2D grid with the dimensions of the number of values for x and y
-        #For all values of x
-            #For all values of y
-                # For all values in r
-                    #Fixing all other values to 1 (in the mean time)
-                    #Add/sum TTA into 2D grid
-                    #if last r divide by number of runs
-
-        #Plot 2D grid
-
-
+        """Plot the heatmap using the parameters given as x axis and y axis
 
+        Parameters are named as in the shape representation (e.g. "nn", "fr").
+        TTAs are queried from the index given, or else from the results index
+        of the study (see ResultIndex), averaged over runs, with one heatmap for each value of
+        the other parameters that has at least two values on both axes.
+        """
+        print("Plotting heatmap "+x+" vs "+y)
+        indexPath = "results/"+self.execID+"/results.sqlite"
+        if self.index is not None:
+            index = self.index
+        elif os.path.exists(indexPath):
+            index = ResultIndex(indexPath)
+        else:
+            index = ResultIndex(":memory:")
+            for result in self.results:
+                index.add(result)
+        fixed = [name for name in self.shapeParameters if name not in (x, y, "r")]
+        grids = index.getTTAGrids(self.shapeParameters[x], self.shapeParameters[y],
+                                  [self.shapeParameters[name] for name in fixed])
+        for values, grid in grids.items():
+            if len(grid.columns) < 2 or len(grid.index) < 2:
+                continue
+            plt.clf()
+            fig, ax = plt.subplots(figsize=(10, 6))
+            image = ax.imshow(grid.values, cmap="hot_r", origin="lower", aspect="auto")
+            for (i, j), tta in np.ndenumerate(grid.values):
+                ax.text(j, i, "%.0f" % tta, ha="center", va="center", color="white" if tta > grid.values.max() / 2 else "black")
+            ax.set_xticks(range(len(grid.columns)), grid.columns)
+            ax.set_yticks(range(len(grid.index)), grid.index)
+            fig.colorbar(image, label="Time to block availability (ms)")
+            plt.title("Time to Block Availability (ms)")
+            plt.xlabel(self.shapeParameters[x])
+            plt.ylabel(self.shapeParameters[y])
+            path = "results/"+self.execID+"/plots/heatmap-"+x+"-"+y+"-"+"-".join("%s-%s" % v for v in zip(fixed, values))+".png"
+            plt.savefig(path, bbox_inches="tight")
+            plt.close()
+            print("Plot %s created." % path)
 
     def plotAll(self):
         """Plot all the important elements of each result"""
@@ -0,0 +1,120 @@
+#!/bin/python3
+
+import os
+import time
+import pickle
+import sqlite3
+
+class WorkQueue:
+    """This class holds the shapes of a study in an SQLite database, for workers to run them.
+
+    A coordinator starts the study with its shapes, and closes it once they
+    are all done or failed. Any number of workers, in other processes or on other hosts sharing the file, then
+    acquire them one at a time, in the order they were added. A shape is
+    leased to its worker for leaseTime seconds, that the worker extends
+    (heartbeat) while it runs it. If the worker stops without completing
+    it, the lease expires and the shape is leased again to another worker,
+    up to maxAttempts times. Leases rely on the clocks of the hosts being
+    synchronized, and on the locking of the filesystem holding the file.
+    """
+
+    def __init__(self, path, leaseTime=60, maxAttempts=3, timeout=60):
+        """It opens the queue stored in path, creating it if needed, waiting up to timeout seconds for locks."""
+        self.path = path
+        self.leaseTime = leaseTime
+        self.maxAttempts = maxAttempts
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # transactions are explicit, so that leasing a shape is atomic
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS study (execID TEXT, state TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (shape TEXT PRIMARY KEY, position INTEGER, data BLOB,"
+                                " status TEXT, worker TEXT, expires REAL, attempts INTEGER, error TEXT)")
+
+    def start(self, execID, shapes):
+        """It starts a new study of shapes, removing the shapes of the previous one.
+
+        Shapes are leased in the order given.
+        """
+        with self.transaction():
+            self.connection.execute("DELETE FROM study")
+            self.connection.execute("DELETE FROM jobs")
+            self.connection.execute("INSERT INTO study VALUES (?, 'open')", (execID,))
+            self.connection.executemany("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, 'pending', NULL, NULL, 0, NULL)",
+                                        [(str(shape), i, pickle.dumps(shape)) for i, shape in enumerate(shapes)])
+
+    def close(self):
+        """It closes the study, so that its workers stop."""
+        with self.transaction():
+            self.connection.execute("UPDATE study SET state = 'closed'")
+
+    def getStudy(self):
+        """It returns the ID and state ("open" or "closed") of the study, or None if none was started."""
+        return self.connection.execute("SELECT execID, state FROM study").fetchone()
+
+    def acquire(self, worker):
+        """It leases the next pending or expired shape to worker and returns it, or returns None if there is none.
+
+        Expired shapes that reached maxAttempts are marked as failed instead.
+        """
+        now = time.time()
+        with self.transaction():
+            self.connection.execute("UPDATE jobs SET status = 'failed', error = 'lease expired ' || attempts || ' times'"
+                                    " WHERE status = 'running' AND expires < ? AND attempts >= ?", (now, self.maxAttempts))
+            row = self.connection.execute("SELECT shape, data FROM jobs WHERE status = 'pending' OR (status = 'running' AND expires < ?)"
+                                          " ORDER BY position LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE jobs SET status = 'running', worker = ?, expires = ?, attempts = attempts + 1"
+                                    " WHERE shape = ?", (worker, now + self.leaseTime, row[0]))
+        return pickle.loads(row[1])
+
+    def heartbeat(self, shape, worker):
+        """It extends the lease of shape by worker, and returns False if worker lost it."""
+        with self.transaction():
+            cursor = self.connection.execute("UPDATE jobs SET expires = ? WHERE shape = ? AND worker = ? AND status = 'running'",
+                                             (time.time() + self.leaseTime, str(shape), worker))
+        return cursor.rowcount > 0
+
+    def complete(self, shape, worker, error=None):
+        """It marks shape as done by worker, or as failed with an error message, and returns False if worker lost its lease."""
+        with self.transaction():
+            cursor = self.connection.execute("UPDATE jobs SET status = ?, error = ? WHERE shape = ? AND worker = ? AND status = 'running'",
+                                             ("failed" if error else "done", error, str(shape), worker))
+        return cursor.rowcount > 0
+
+    def getCounts(self):
+        """It returns the number of shapes of the study by status ("pending", "running", "done" and "failed")."""
+        counts = dict.fromkeys(("pending", "running", "done", "failed"), 0)
+        counts.update(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return counts
+
+    def getErrors(self):
+        """It returns the error messages of the failed shapes, by shape."""
+        return dict(self.connection.execute("SELECT shape, error FROM jobs WHERE status = 'failed'").fetchall())
+
+    def isDrained(self):
+        """It returns whether all the shapes of the study are done or failed."""
+        counts = self.getCounts()
+        return counts["pending"] == counts["running"] == 0
+
+    def transaction(self):
+        """It returns a context manager running its block in a write transaction."""
+        return Transaction(self.connection)
+
+
+class Transaction:
+    """This class runs a block in an SQLite transaction that takes the write lock immediately."""
+
+    def __init__(self, connection):
+        """It initializes the transaction on connection."""
+        self.connection = connection
+
+    def __enter__(self):
+        """It begins the transaction."""
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, type, value, traceback):
+        """It commits the transaction, or rolls it back if the block raised."""
+        self.connection.execute("COMMIT" if type is None else "ROLLBACK")
+        return False
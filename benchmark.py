@@ -0,0 +1,72 @@
+#! /bin/python3
+
+"""Micro-benchmarks of the simulator hot paths
+
+Each benchmark times the current implementation against the one it replaced,
+on synthetic state. To run all of them, use
+   python3 benchmark.py
+"""
+
+import random
+import timeit
+from types import SimpleNamespace
+from DAS.validator import Neighbor, Validator
+from DAS.block import Block, DualBlock
+
+def report(name, old, new):
+    """Print old and new timings (in ns per call) and the speedup."""
+    print("%-40s old %8.1f ns  new %8.1f ns  speedup %5.1fx" % (name, old * 1e9, new * 1e9, old / new))
+
+def checkSegmentToNeigh(lineSize=512, number=200000):
+    """Compare the per-link 'sent enough' check with a full line popcount.
+
+    The link has exchanged a random half of the segments of the line, below
+    the sendLineUntil threshold, so both versions go on checking the segment.
+    """
+    random.seed(0)
+    neigh = Neighbor(None, 0, lineSize)
+    for i in random.sample(range(lineSize), lineSize // 4):
+        neigh.sent[i] = 1
+    for i in random.sample(range(lineSize), lineSize // 4):
+        neigh.received[i] = 1
+    neigh.known = (neigh.sent | neigh.received).count(1)
+    # only the attributes used by the check
+    val = SimpleNamespace(sendLineUntilR=lineSize // 2 + lineSize // 4, sendLineUntilC=lineSize)
+
+    def oldCheck(rID, cID, neigh):
+        if (neigh.sent | neigh.received).count(1) >= (val.sendLineUntilC if neigh.dim else val.sendLineUntilR):
+            return False
+        i = rID if neigh.dim else cID
+        return not neigh.sent[i] and not neigh.received[i]
+
+    cID = neigh.sent.index(0)
+    assert oldCheck(0, cID, neigh) == Validator.checkSegmentToNeigh(val, 0, cID, neigh)
+    newCheck = Validator.checkSegmentToNeigh
+    old = timeit.timeit("check(0, cID, neigh)", globals={"check": oldCheck, "cID": cID, "neigh": neigh}, number=number) / number
+    new = timeit.timeit("check(val, 0, cID, neigh)", globals={"check": newCheck, "val": val, "cID": cID, "neigh": neigh}, number=number) / number
+    report("checkSegmentToNeigh (%d wide line)" % lineSize, old, new)
+
+def columnAccess(blockSize=512, number=20000):
+    """Compare reading and repairing a column of a Block and of a DualBlock.
+
+    Half of the segments of the block are set at random, so that reading a
+    column copies it, and repairing one fills its missing segments.
+    """
+    random.seed(0)
+    blocks = [Block(blockSize, blockSize // 2), DualBlock(blockSize, blockSize // 2)]
+    for r, c in random.sample([(r, c) for r in range(blockSize) for c in range(blockSize)], blockSize * blockSize // 2):
+        for block in blocks:
+            block.setSegment(r, c)
+    assert blocks[0].getColumn(1) == blocks[1].getColumn(1)
+    old, new = (timeit.timeit("block.getColumn(1).count(1)", globals={"block": block}, number=number) / number for block in blocks)
+    report("getColumn (%d wide block)" % blockSize, old, new)
+    # repairing an already full column is a read, like most repairs
+    for block in blocks:
+        block.repairColumn(1)
+    assert blocks[0].data == blocks[1].data
+    old, new = (timeit.timeit("block.repairColumn(1)", globals={"block": block}, number=number) / number for block in blocks)
+    report("repairColumn (%d wide block)" % blockSize, old, new)
+
+if __name__ == "__main__":
+    checkSegmentToNeigh()
+    columnAccess()
@@ -21,6 +21,11 @@ from DAS.shape import Shape
 # Dump results into XML files
 dumpXML = 1
 
+# format of the dumped results: "xml" writes one pretty printed XML file per
+# run, "npz" appends them to the results.npz archive of the study instead (see
+# ResultArchive, which can also export them to XML files)
+resultFormat = "xml"
+
 # save progress and row/column distribution vectors to XML
 saveProgress = 1
 
@@ -40,6 +45,67 @@ logLevel = logging.INFO
 # for more details, see joblib.Parallel
 numJobs = -1
 
+# simulation engine: "object" keeps one Validator object per node, "vector"
+# keeps the whole network in NumPy arrays (see DAS/vectorized.py), which
+# scales to networks of 10k+ nodes. The engines order sends differently (see
+# VectorizedSimulator), so their results agree only in distribution: do not
+# mix results of both engines
+engine = "object"
+
+# store only the subscribed rows and columns in each node (True), instead of
+# two full copies of the block per node (False)
+lineStorage = True
+
+# layout of the blocks stored in full (all blocks without lineStorage, the
+# proposer one otherwise): "row" keeps segments row by row, "dual" also keeps
+# a column-major copy, so that column accesses are as cheap as row ones
+blockLayout = "row"
+
+# build the row/column meshes with the batched NumPy random regular graph
+# generator ("numpy"), or one networkx graph per line ("networkx")
+topologyBackend = "numpy"
+
+# directory where the line assignments and meshes of deterministic runs are
+# cached, to be reused by runs with the same topology (None to disable)
+topologyCache = "results/topology"
+
+# directory where the results of deterministic runs are cached, so that an
+# interrupted study resumes where it stopped (None to disable). Entries are
+# kept per version of the simulator code, and only the ones of the 3 most
+# recently used versions are kept when a study starts
+resultCache = "results/cache"
+
+# SQLite database where the runtimes of runs are recorded, per engine. The
+# shapes of a study run from the most expensive to the cheapest, estimated
+# from their parameters and refined with these runtimes (see CostModel).
+# None to only use the estimate from parameters
+runtimeLog = "results/runtimes.sqlite"
+
+# SQLite database of the work queue of distributed studies (see WorkQueue),
+# and lease time of its shapes in seconds. A study is distributed with
+#   python3 study.py smallConf.py coordinator [workers]
+# that queues its shapes and starts workers on this host (numJobs of them
+# by default), and, on any other host sharing the file,
+#   python3 study.py smallConf.py worker
+workQueue = "results/queue.sqlite"
+leaseTime = 60
+
+# initialize validators and network once for shapes that only differ in
+# failureModel/failureRate, and run each of them in a fork of that state
+# (deterministic runs on platforms with os.fork only)
+forkWarmStart = True
+
+# runs whose released block can not make the block available (see
+# Block.getRecoverable): "run" simulates them in full, "shorten" stops them
+# as soon as no more segments can arrive, "skip" does not simulate them
+hopelessRuns = "shorten"
+
+# with the vector engine, run all the runs of a shape together in one
+# process, their networks stacked in the same arrays (see ReplicaBatch).
+# Results are the same, it only pays off for small networks, whose steps
+# are dominated by interpreter overhead. Takes precedence over forkWarmStart
+batchRuns = False
+
 # distribute rows/columns evenly between validators (True)
 # or generate it using local randomness (False)
 evenLineDistribution = True
@@ -50,7 +116,8 @@ runs = range(3)
 # Number of validators
 numberNodes = range(128, 513, 128)
 
-# select failure model between: "random, sequential, MEP, MEP+1, DEP, DEP+1, MREP, MREP-1"
+# select failure model between: "random, sequential, MEP, MEP+1, DEP, DEP+1, MREP, MREP-1,
+# columnBurst, diagonal" (see DAS/patterns.py)
 failureModels = ["random"]
 
 # Percentage of block not released by producer
@@ -101,6 +168,18 @@ diagnostics = False
 # True to save git diff and git commit
 saveGit = False
 
+# Instead of running every shape, search for each combination of the other
+# parameters the failure rate from which the block stops being available
+# (in most runs), between the lowest and highest of failureRates (see
+# ThresholdSearch). Failure rates are bisected down to thresholdPrecision
+# (at least 1), each one probed with a number of runs in the thresholdRuns
+# range: more runs while its availability is uncertain at
+# thresholdConfidence. runs is ignored. Thresholds are saved to thresholds.csv in the results folder
+thresholdSearch = False
+thresholdRuns = (4, 16)
+thresholdPrecision = 1
+thresholdConfidence = 0.95
+
 def nextShape():
     for run, fm, fr, class1ratio, chi, vpn1, vpn2, blockSize, nn, netDegree, bwUplinkProd, bwUplink1, bwUplink2 in itertools.product(
         runs, failureModels, failureRates, class1ratios, chis, validatorsPerNode1, validatorsPerNode2, blockSizes, numberNodes, netDegrees, bwUplinksProd, bwUplinks1, bwUplinks2):
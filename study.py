@@ -1,10 +1,20 @@
 #! /bin/python3
 
 import time, sys, random, copy
+import os, pickle, select, signal, traceback
 import importlib
 import subprocess
-from joblib import Parallel, delayed
+import socket
+import sqlite3
+import pandas as pd
+import threading
+import _thread
+from joblib import Parallel, delayed, effective_n_jobs
 from DAS import *
+from DAS.results import ResultArchive, ResultCache, ResultIndex
+from DAS.costs import CostModel
+from DAS.workqueue import WorkQueue
+from DAS.threshold import ThresholdSearch
 
 # Parallel execution:
 # The code currently uses 'joblib' to execute on multiple cores. For other options such as 'ray', see
@@ -23,21 +33,50 @@ def initLogger(config):
     logger.addHandler(ch)
     return logger
 
-def runOnce(config, shape, execID):
+def setSeeds(config, shape):
+    """It sets the seeds of a shape, if the study is deterministic.
 
+    The topology is drawn from its own seed, so that shapes differing only
+    in failures or bandwidth share it (and its cache entry).
+    """
     if config.deterministic:
         shape.setSeed(config.randomSeed+"-"+str(shape))
-        random.seed(shape.randomSeed)
+        shape.setTopologySeed(config.randomSeed+"-"+shape.topologyRepr())
+
+def initSimulation(config, shape, execID):
+    """It returns a simulator of shape, with its validators and network initialized."""
+    setSeeds(config, shape)
+    if config.deterministic:
+        random.seed(shape.topologySeed)
 
-    sim = Simulator(shape, config, execID)
+    if config.engine == "vector":
+        sim = VectorizedSimulator(shape, config, execID)
+    else:
+        sim = Simulator(shape, config, execID)
     sim.initLogger()
     sim.initValidators()
     sim.initNetwork()
+    return sim
+
+def runSimulation(config, sim, execID):
+    """It runs an initialized simulation, then dumps and plots its result as configured."""
+    if config.deterministic:
+        random.seed(sim.shape.randomSeed)
+    start = time.time()
     result = sim.run()
+    result.runtime = time.time() - start
+    return reportResult(config, sim, result, execID)
+
+def reportResult(config, sim, result, execID):
+    """It logs, dumps and plots the result of a simulation as configured, and returns it."""
     sim.logger.info("Shape: %s ... Block Available: %d in %d steps" % (str(sim.shape.__dict__), result.blockAvailable, len(result.missingVector)), extra=sim.format)
 
+    cache = getResultCache(config)
+    if cache:
+        cache.save(result)
+
     if config.dumpXML:
-        result.dump()
+        result.dump(config.resultFormat)
 
     if config.visualization:
         visual = Visualizor(execID, config, [result])
@@ -45,6 +84,318 @@ def runOnce(config, shape, execID):
 
     return result
 
+def runOnce(config, shape, execID):
+    """It runs shape, unless its result is in the result cache."""
+    result = loadResult(config, shape, execID)
+    if result is None:
+        result = runSimulation(config, initSimulation(config, shape, execID), execID)
+    return result
+
+def getResultCache(config):
+    """It returns the result cache, if results of the study are cached."""
+    if config.resultCache and config.deterministic:
+        return ResultCache(config.resultCache, config)
+    return None
+
+def loadResult(config, shape, execID):
+    """It returns the cached result of shape, dumped in this study as configured, or None."""
+    cache = getResultCache(config)
+    result = cache.load(shape) if cache else None
+    if result is not None:
+        result.execID = execID
+        if config.dumpXML:
+            result.dump(config.resultFormat)
+    return result
+
+def warmStartKey(shape):
+    """It returns what a shape has in common with the shapes it can be forked with."""
+    return tuple((k, v) for k, v in sorted(shape.__dict__.items())
+                 if k not in ("failureModel", "failureRate", "randomSeed", "topologySeed"))
+
+def forkRun(config, sim, shape, execID):
+    """It runs shape in a child process forked from the initialized simulator sim, or initializing its own if sim is None.
+
+    The child shares the validators and network of sim (copy-on-write),
+    switches to the failure model and rate of shape, and only runs the
+    simulation. It returns the pid of the child and a pipe to read the
+    pickled result from.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # the child must never return, even if the parent stopped reading
+        status = 1
+        try:
+            os.close(r)
+            with os.fdopen(w, "wb") as f:
+                try:
+                    if sim is None:
+                        sim = initSimulation(config, shape, execID)
+                    else:
+                        setSeeds(config, shape)
+                        sim.shape.__dict__.update(shape.__dict__)
+                    pickle.dump(runSimulation(config, sim, execID), f)
+                    status = 0
+                except BaseException:
+                    pickle.dump(RuntimeError("Simulation of %s failed:\n%s" % (shape, traceback.format_exc())), f)
+        finally:
+            os._exit(status)
+    os.close(w)
+    return pid, os.fdopen(r, "rb")
+
+def collectRun(pid, pipe, shape):
+    """It returns the result of shape sent by a child process started with forkRun.
+
+    If the child died without sending it, it raises an error giving how.
+    """
+    with pipe:
+        try:
+            result = pickle.load(pipe)
+        except (EOFError, pickle.UnpicklingError):
+            result = None
+    _, status = os.waitpid(pid, 0)
+    if result is None:
+        if os.WIFSIGNALED(status):
+            how = "was killed by signal %s" % signal.Signals(os.WTERMSIG(status)).name
+        else:
+            how = "exited with status %d" % os.waitstatus_to_exitcode(status)
+        raise RuntimeError("Simulation of %s failed: its process %d %s without sending its result" % (shape, pid, how))
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+def collectFirstRun(running):
+    """It returns the result of the first child to send it, among running ones (a dict of pids and shapes by pipe), and removes that child."""
+    ready, _, _ = select.select(list(running), [], [])
+    pid, shape = running.pop(ready[0])
+    return collectRun(pid, ready[0], shape)
+
+def runWarmStart(config, shapes, execID):
+    """It runs shapes, initializing each topology only once.
+
+    Shapes that only differ in their failure model or rate are grouped.
+    Each shape runs in its own child process, at most numJobs at a time,
+    in the order of shapes: a new one starts as soon as any of the running
+    ones completes. The validators and network of a group of several shapes
+    are initialized once, before its first shape starts, and each of its
+    shapes runs in a fork of that state; they are released once its last
+    shape started. A shape alone in its group is initialized in its child,
+    so that such initializations run in parallel. Results are yielded as
+    runs complete.
+    """
+    sizes = {}
+    for shape in shapes:
+        key = warmStartKey(shape)
+        sizes[key] = sizes.get(key, 0) + 1
+
+    sims = {}
+    running = {} # pipe -> (pid, shape)
+    jobs = effective_n_jobs(config.numJobs)
+    for shape in shapes:
+        key = warmStartKey(shape)
+        if sizes[key] > 1 and key not in sims:
+            sims[key] = initSimulation(config, copy.copy(shape), execID)
+        if len(running) >= jobs:
+            yield collectFirstRun(running)
+        pid, pipe = forkRun(config, sims.get(key), shape, execID)
+        running[pipe] = (pid, shape)
+        sizes[key] -= 1
+        if sizes[key] == 0:
+            sims.pop(key, None)
+    while running:
+        yield collectFirstRun(running)
+
+def batchKey(shape):
+    """It returns what a shape has in common with the other runs it can be batched with."""
+    return tuple((k, v) for k, v in sorted(shape.__dict__.items())
+                 if k not in ("run", "randomSeed", "topologySeed"))
+
+def runBatch(config, shapes, execID):
+    """It runs shapes that only differ in their run together, with the vector engine.
+
+    Each replica is initialized and prepared with its own seeds, as in
+    runOnce, then all of them are advanced by one ReplicaBatch.
+    """
+    sims = [initSimulation(config, shape, execID) for shape in shapes]
+    loops = []
+    for sim in sims:
+        if config.deterministic:
+            random.seed(sim.shape.randomSeed)
+        loops.append(sim.runSteps(sim.prepareRun()))
+    start = time.time()
+    results = ReplicaBatch(sims).run(loops)
+    runtime = (time.time() - start) / len(results)
+    for result in results:
+        result.runtime = runtime
+    return [reportResult(config, sim, result, execID) for sim, result in zip(sims, results)]
+
+def runBatches(config, shapes, execID):
+    """It runs shapes in batches of runs (see runBatch), in parallel, in the order of their first shape.
+
+    Results are yielded as batches complete.
+    """
+    groups = {}
+    for shape in shapes:
+        groups.setdefault(batchKey(shape), []).append(shape)
+    batches = Parallel(config.numJobs, return_as="generator_unordered", batch_size=1)(delayed(runBatch)(config, group, execID) for group in groups.values())
+    for batch in batches:
+        yield from batch
+
+def runShapes(config, shapes, execID):
+    """It runs shapes in parallel, as configured, and yields their results as they complete."""
+    if config.batchRuns and config.engine == "vector":
+        return runBatches(config, shapes, execID)
+    elif config.forkWarmStart and config.deterministic and hasattr(os, "fork"):
+        return runWarmStart(config, shapes, execID)
+    else:
+        return Parallel(config.numJobs, return_as="generator_unordered", batch_size=1)(delayed(runOnce)(config, shape ,execID) for shape in shapes)
+
+def searchKey(shape):
+    """It returns what a shape has in common with the other shapes of its threshold search."""
+    return tuple((k, v) for k, v in sorted(shape.__dict__.items())
+                 if k not in ("failureRate", "run", "randomSeed", "topologySeed"))
+
+def searchThresholds(config, shapes, execID, index, costs):
+    """It searches the failure rate threshold of availability for each combination of the other parameters of shapes.
+
+    Each search (see ThresholdSearch) ranges between the lowest and highest
+    failure rates of its shapes. All searches advance together: their next
+    runs are run in parallel, or loaded from the result cache. It returns the
+    reports of the searches, as a DataFrame with one row per combination,
+    and the number of runs that were not in the cache.
+    """
+    searches = {}
+    for shape in shapes:
+        searches.setdefault(searchKey(shape), []).append(shape.failureRate)
+    searches = {key: ThresholdSearch(Shape(**dict(key, failureRate=None, run=None)), min(failureRates), max(failureRates),
+                                     config.thresholdRuns[0], config.thresholdRuns[1], config.thresholdPrecision, config.thresholdConfidence)
+                for key, failureRates in searches.items()}
+    pending = [shape for search in searches.values() for shape in search.nextShapes()]
+    ran = 0
+    while pending:
+        shapes = []
+        for shape in pending:
+            result = loadResult(config, shape, execID)
+            if result is None:
+                shapes.append(shape)
+            else:
+                searches[searchKey(result.shape)].addResult(result)
+                index.add(result)
+        for result in runShapes(config, costs.schedule(shapes), execID):
+            searches[searchKey(result.shape)].addResult(result)
+            index.add(result)
+            costs.record(result)
+            ran += 1
+        pending = [shape for search in searches.values() for shape in search.nextShapes()]
+    reports = pd.DataFrame([dict(search.shape.__dict__, **search.getReport()) for search in searches.values()]
+                           ).drop(columns=["failureRate", "run", "randomSeed", "topologySeed"])
+    return reports, ran
+
+def keepLease(config, path, shape, worker, stop, lost, lock, logger, format):
+    """It extends the lease of shape by worker, in the work queue stored in path, until stop is set.
+
+    Heartbeats that fail, as when the database is locked, are retried
+    every second until the lease expires. If the lease is lost, lost is
+    set and the run of shape is aborted (KeyboardInterrupt in the main
+    thread), unless stop was set in the meantime (under lock).
+    """
+    queue = WorkQueue(path, config.leaseTime, timeout=config.leaseTime / 3)
+    expires = time.time() + config.leaseTime
+    wait = config.leaseTime / 3
+    while not stop.wait(wait):
+        try:
+            if queue.heartbeat(shape, worker):
+                expires = time.time() + config.leaseTime
+                wait = config.leaseTime / 3
+                continue
+            logger.warning("Lease of %s was lost" % shape, extra=format)
+        except sqlite3.OperationalError as e:
+            logger.warning("Heartbeat of %s failed: %s" % (shape, e), extra=format)
+            if time.time() + 1 < expires:
+                wait = 1
+                continue
+            logger.warning("Lease of %s expired" % shape, extra=format)
+        with lock:
+            if not stop.is_set():
+                lost.set()
+                _thread.interrupt_main()
+        return
+
+def runWorker(config, queue, logger, format, execID=None):
+    """It runs shapes leased from the work queue, until its study is closed.
+
+    A worker runs the shapes of study execID, which must have been started.
+    Without execID, it waits for a study to be open, and only runs the
+    shapes of the first one it finds. Results are dumped as configured and
+    indexed in the queue database (see ResultIndex), so that the
+    coordinator can plot them.
+    """
+    worker = "%s-%d" % (socket.gethostname(), os.getpid())
+    costs = CostModel(config.runtimeLog, config.engine)
+    while True:
+        study = queue.getStudy()
+        if execID is None:
+            if study is None or study[1] == "closed":
+                time.sleep(1)
+                continue
+            execID = study[0]
+        if study is None or study[0] != execID or study[1] == "closed":
+            break
+        shape = queue.acquire(worker)
+        if shape is None:
+            time.sleep(1)
+            continue
+        stop, lost, lock = threading.Event(), threading.Event(), threading.Lock()
+        lease = threading.Thread(target=keepLease, args=(config, queue.path, shape, worker, stop, lost, lock, logger, format), daemon=True)
+        lease.start()
+        try:
+            result = runOnce(config, shape, execID)
+            with lock:
+                stop.set()
+        except KeyboardInterrupt:
+            if not lost.is_set():
+                raise
+            logger.warning("Simulation of %s aborted" % shape, extra=format)
+            continue
+        except Exception:
+            logger.error("Simulation of %s failed" % shape, exc_info=True, extra=format)
+            queue.complete(shape, worker, traceback.format_exc())
+            continue
+        finally:
+            stop.set()
+            lease.join()
+        ResultIndex(queue.path).add(result)
+        costs.record(result)
+        if not queue.complete(shape, worker):
+            logger.warning("Lease of %s expired before it completed" % shape, extra=format)
+
+def runCoordinator(config, queue, execID, shapes, workers, logger, format):
+    """It starts a study of shapes in the work queue, and workers on this host, then waits until the study is finished and closes it.
+
+    A local worker exiting before the study is finished is an error, that
+    closes the study and stops the other local workers.
+    """
+    queue.start(execID, shapes)
+    processes = [subprocess.Popen([sys.executable, sys.argv[0], sys.argv[1], "worker", execID]) for _ in range(workers)]
+    counts = None
+    while not queue.isDrained():
+        for process in processes:
+            if process.poll() is not None:
+                queue.close()
+                for other in processes:
+                    other.terminate()
+                    other.wait()
+                raise RuntimeError("Worker %d exited with status %d before the study was finished" % (process.pid, process.returncode))
+        if queue.getCounts() != counts:
+            counts = queue.getCounts()
+            logger.info("Queue: %d pending, %d running, %d done, %d failed" % tuple(counts.values()), extra=format)
+        time.sleep(1)
+    queue.close()
+    for process in processes:
+        process.wait()
+    for shape, error in queue.getErrors().items():
+        logger.error("Simulation of %s failed: %s" % (shape, error), extra=format)
+
 def study():
     if len(sys.argv) < 2:
         print("You need to pass a configuration file in parameter")
@@ -63,7 +414,18 @@ def study():
     logger = initLogger(config)
     format = {"entity": "Study"}
 
-    results = []
+    # the study can also be distributed through a work queue: a coordinator
+    # queues its shapes, and workers, on any host sharing the queue, run them
+    mode = sys.argv[2] if len(sys.argv) > 2 else None
+    if mode not in (None, "coordinator", "worker"):
+        print("Unknown mode %s, use coordinator or worker" % mode)
+        exit(1)
+    if mode == "coordinator" and config.thresholdSearch:
+        print("Threshold searches can not be distributed")
+        exit(1)
+    if mode == "worker":
+        runWorker(config, WorkQueue(config.workQueue, config.leaseTime), logger, format, sys.argv[3] if len(sys.argv) > 3 else None)
+        return
 
     now = datetime.now()
     execID = now.strftime("%Y-%m-%d_%H-%M-%S_")+str(random.randint(100,999))
@@ -83,15 +445,58 @@ def study():
 
     logger.info("Starting simulations:", extra=format)
     start = time.time()
-    results = Parallel(config.numJobs)(delayed(runOnce)(config, shape ,execID) for shape in config.nextShape())
+    # results are not kept: each one is stored by its run, and only what the
+    # final plots need is indexed here as it arrives (or by the workers)
+    if mode == "coordinator":
+        queue = WorkQueue(config.workQueue, config.leaseTime)
+        index = ResultIndex(queue.path)
+        index.clear()
+    else:
+        index = ResultIndex(":memory:")
+    shapes = []
+    cache = getResultCache(config)
+    if cache:
+        cache.prune()
+    costs = CostModel(config.runtimeLog, config.engine)
+    if config.thresholdSearch:
+        thresholds, ran = searchThresholds(config, list(config.nextShape()), execID, index, costs)
+        thresholds.to_csv(dir+"/thresholds.csv", index=False)
+        ResultArchive(dir+"/results.npz").consolidate()
+        for report in thresholds.to_dict("records"):
+            logger.info("Threshold: %s" % report, extra=format)
+        if len(index) > ran:
+            logger.info("%d simulations found in the result cache" % (len(index) - ran), extra=format)
+        logger.info("A total of %d simulations ran in %d seconds" % (ran, time.time()-start), extra=format)
+        return
+    for shape in config.nextShape():
+        result = loadResult(config, shape, execID)
+        if result is None:
+            shapes.append(shape)
+        else:
+            index.add(result)
+    cached = len(index)
+    if cached:
+        logger.info("%d simulations found in the result cache" % cached, extra=format)
+    # the most expensive shapes first, each idle worker taking the next one,
+    # so that no long run starts last
+    shapes = costs.schedule(shapes)
+    if mode == "coordinator":
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else effective_n_jobs(config.numJobs)
+        runCoordinator(config, queue, execID, shapes, workers, logger, format)
+    else:
+        for result in runShapes(config, shapes, execID):
+            index.add(result)
+            costs.record(result)
+    ResultArchive(dir+"/results.npz").consolidate()
     end = time.time()
-    logger.info("A total of %d simulations ran in %d seconds" % (len(results), end-start), extra=format)
+    # the workers of a coordinator index their results in the same database
+    logger.info("A total of %d simulations ran in %d seconds" % (len(index) - cached, end-start), extra=format)
 
     if config.visualization:
         vis = Visualizer(execID, config)
         vis.plotHeatmaps()
 
-        visual = Visualizor(execID, config, results)
+        visual = Visualizor(execID, config, [], index)
         visual.plotHeatmaps("nn", "fr")
 
 if __name__ == "__main__":